@@ -0,0 +1,137 @@
+# benchmarks for the MCTS engines, run as e.g. python bench.py threads
+
+from contextlib import redirect_stdout, redirect_stderr
+from mctsShared import SharedArrayMCTS, cpu_count
+from mctsTT import TranspositionMCTS
+import tictactoe as ttt
+from mcts import *
+import io, sys
+
+def quiet(): # the engines print progress bars and timings on every move
+    out = io.StringIO()
+    return redirect_stdout(out), redirect_stderr(out)
+
+def countNodes(root):
+    seen = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            stack.extend(node.children.values())
+    return len(seen)
+
+def tttValue(board, piece, memo={}): # exact value of a tic-tac-toe board for the side to move, by exhaustive negamax
+    key = (board.tobytes(), piece)
+    if key not in memo:
+        ended = ttt.TTTState(board).isTerminal()
+        if ended is not None:
+            memo[key] = ended * piece
+        else:
+            memo[key] = max(tttMoveValues(board, piece).values())
+    return memo[key]
+
+def tttMoveValues(board, piece):
+    ret = {}
+    for move in np.flatnonzero(board.reshape(-1) == 0):
+        child = board.copy()
+        child.reshape(-1)[move] = piece
+        ended = ttt.TTTState(child).isTerminal()
+        ret[int(move)] = ended * piece if ended is not None else -tttValue(child, -piece)
+    return ret
+
+def tttPositions(num=30, seed=0): # positions with O (the AI) to move where not every move is equally good
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < num:
+        board = np.zeros((ttt.length, ttt.length), dtype=np.int8)
+        piece = -1
+        for ply in range(rng.choice((1, 3, 5))):
+            empty = np.flatnonzero(board.reshape(-1) == 0)
+            board.reshape(-1)[rng.choice(empty)] = piece
+            piece = -piece
+        if ttt.TTTState(board).isTerminal() is not None:
+            continue
+        values = tttMoveValues(board, 1)
+        best = max(values.values())
+        if min(values.values()) < best:
+            positions.append((board, {move for move, value in values.items() if value == best}))
+    return positions
+
+def accuracy(engine, trials, positions, **kwargs): # share of positions where the engine picks a game-theoretically best move
+    correct = 0
+    nodes = 0
+    for board, bestMoves in positions:
+        ai = engine(ttt.TTT, ttt.TTTNode, trialsPerMove=trials, **kwargs)
+        ai.root = ttt.TTTNode(state=ttt.TTTState(board.copy()))
+        out, err = quiet()
+        with out, err:
+            bestChild, _ = ai.play(ai.root.state)
+        correct += bestChild.parentMoveVal in bestMoves
+        nodes += countNodes(ai.root)
+    return correct / len(positions), nodes / len(positions)
+
+def benchThreads(threadCounts=(1, 2, 4, 8), trials=20000): # playouts/sec of tree-parallel search on the opening position
+    for numThreads in threadCounts:
+        ai = MCTS(ttt.TTT, ttt.TTTNode, trialsPerMove=trials, numThreads=numThreads)
+        ai.root = ttt.TTTNode(state=ttt.TTTState())
+        start = time.time()
+        ai.search()
+        print('{} threads: {} playouts/sec'.format(numThreads, round(ai.root.plays / (time.time() - start))))
+
+def benchShared(procCounts=(1, 2, 4), trials=20000): # pretraining trials/sec of one shared-memory tree, by number of processes
+    print('{} cores'.format(cpu_count()))
+    for numProcs in procCounts:
+        ai = SharedArrayMCTS(ttt.TTT, ttt.TTTNode, trialsPerMove=trials, numProcs=numProcs)
+        ai.root = ttt.TTTNode(state=ttt.TTTState())
+        start = time.time()
+        out, err = quiet()
+        with out, err:
+            ai.search()
+        print('{} processes: {} trials/sec, {} nodes'.format(numProcs, round(trials / (time.time() - start)), ai.tree.size))
+
+def benchTranspositions(trialCounts=(100, 300, 1000)): # tree size and move quality with and without a transposition table
+    positions = tttPositions()
+    for trials in trialCounts:
+        for engine in (MCTS, TranspositionMCTS):
+            random.seed(0)
+            acc, nodes = accuracy(engine, trials, positions)
+            print('{} trials | {}: {}% best moves, {} nodes'.format(trials, engine.__name__, round(acc * 100), round(nodes)))
+
+def benchSolver(trialCounts=(100, 300, 1000)): # move quality and tree size with and without MCTS-Solver
+    positions = tttPositions()
+    for trials in trialCounts:
+        for solver in (False, True):
+            random.seed(0)
+            acc, nodes = accuracy(MCTS, trials, positions, solver=solver)
+            print('{} trials | solver={}: {}% best moves, {} nodes'.format(trials, solver, round(acc * 100), round(nodes)))
+
+def benchRave(trialCounts=(50, 100, 300, 1000), raveK=10): # move quality at each trial count with and without RAVE
+    positions = tttPositions(100) # enough positions that a few lucky picks don't swing the comparison
+    for trials in trialCounts:
+        for k in (None, raveK):
+            random.seed(0)
+            acc, nodes = accuracy(MCTS, trials, positions, raveK=k)
+            print('{} trials | raveK={}: {}% best moves, {} nodes'.format(trials, k, round(acc * 100), round(nodes)))
+
+def benchHalving(trialCounts=(100, 1000, 10000)): # move quality of UCB at the root against sequential halving
+    positions = tttPositions()
+    for trials in trialCounts:
+        for halving in (False, True):
+            random.seed(0)
+            acc, nodes = accuracy(MCTS, trials, positions, halving=halving)
+            print('{} trials | halving={}: {}% best moves, {} nodes'.format(trials, halving, round(acc * 100), round(nodes)))
+
+benchmarks = {
+    'threads': benchThreads,
+    'shared': benchShared,
+    'transpositions': benchTranspositions,
+    'solver': benchSolver,
+    'rave': benchRave,
+    'halving': benchHalving,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        print('#', name)
+        benchmarks[name]()
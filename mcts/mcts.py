@@ -1,10 +1,11 @@
 # resource classes for two-player games that have MCTS AIs
 
+from contextlib import nullcontext
 from tqdm import tqdm
 import pickle as pkl
 import numpy.random as npr
 import numpy as np
-import random, time, pdb
+import os, queue, random, struct, sys, time, threading, pdb
 
 def logg(*args):
     print(*args)
@@ -24,13 +25,29 @@ class State:
         myClass = type(self)
         return myClass(state=self.state)
 
+    def key(self): # hashable summary of the position, equal for transposed positions
+        return self.state
+
     def findState(move, currentState): # tells how a move affects a state of the game, i.e. a move of 3 with 11 as the currentState will yield 8
         stateCopy = currentState.copy()
         stateCopy.update(move)
         return stateCopy
 
+provenWin, provenDraw, provenLoss = 1, 0, -1 # game-theoretic results for the player who moved into a node
+
+class RewardProbe: # stands in for a node when asking the game for the reward of either side
+    def __init__(self, parentIsAI):
+        self.parentIsAI = parentIsAI
+
 class Node:
-    def __init__(self, parentMoveVal=None, state=None, parent=None, children=set(), parentIsAI=False):
+    proven = None # set by the MCTS solver once the node's result is known for certain
+    amafWins = 0 # all-moves-as-first totals, only kept up in RAVE mode
+    amafPlays = 0
+    untried = None # legal moves not expanded yet, listed the first time they're needed and popped by expand
+
+    def __init__(self, parentMoveVal=None, state=None, parent=None, children=None, parentIsAI=False):
+        if children is None: # a {} default would be one dict shared by every node created without children
+            children = {}
         self.wins = 0
         self.plays = 0
         self.ucb = 0
@@ -57,9 +74,13 @@ class Node:
         ret.parentIsAI = self.parentIsAI
         return ret
 
-    def calcUCB(self, c=2**0.5):
+    def calcUCB(self, c=2**0.5, raveK=None):
         if not self.ucbUpdated:
-            self.ucb = self.wins / self.plays + c * (np.log(self.parent.plays) / self.plays) ** 0.5
+            value = self.wins / self.plays
+            if raveK is not None and self.amafPlays > 0: # lean on the AMAF estimate while the node has few plays of its own
+                beta = (raveK / (3 * self.plays + raveK)) ** 0.5
+                value = (1 - beta) * value + beta * self.amafWins / self.amafPlays
+            self.ucb = value + c * (np.log(self.parent.plays) / self.plays) ** 0.5
             self.ucbUpdated = True
         return self.ucb
 
@@ -67,12 +88,31 @@ class Node:
         return self.state.isTerminal()
 
     def isLeaf(self):
-        return len(self.children) != len(self.listMoves())
+        return len(self.untriedMoves()) > 0
+
+    def untriedMoves(self):
+        if self.untried is None:
+            self.untried = [move for move in self.listMoves() if move not in self.children]
+            random.shuffle(self.untried) # so popping off the end expands moves in random order
+        return self.untried
+
+    def addChild(self, child):
+        self.children[child.parentMoveVal] = child
+        if self.untried is not None and child.parentMoveVal in self.untried:
+            self.untried.remove(child.parentMoveVal)
+
+    def removeChild(self, child):
+        del self.children[child.parentMoveVal]
+        if self.untried is not None:
+            self.untried.insert(random.randrange(len(self.untried) + 1), child.parentMoveVal)
 
     def findChild(self, val):
-        for child in self.children:
-            if child.parentMoveVal == val:
-                return child
+        return self.children.get(val)
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        if isinstance(self.children, set): # trees pickled before children were keyed by move
+            self.children = {child.parentMoveVal: child for child in self.children}
 
 class Game:
     def __init__(self, state=None):
@@ -88,22 +128,32 @@ class Game:
     def printState(self):
         print(self.state.state)
 
-    def simulate(node):
+    def simulate(node, moves=None): # if given a list, appends (move, whether the AI made it) for every move played
         nodeClass = type(node)
         temp = node.copy()
         tempState = temp.state
 
         ended = temp.isTerminal()
         while ended is None:
-            move = random.sample(temp.listMoves(), 1)[0]
+            move = random.choice(tuple(temp.listMoves()))
             tempState.update(move)
             temp.parentIsAI = not temp.parentIsAI
+            if moves is not None:
+                moves.append((move, temp.parentIsAI))
             ended = temp.isTerminal()
         return ended
 
-    def fightAI(self, nodeClass, loadFile=None, trialsPerMove=10):
+    @classmethod
+    def simulateBatch(cls, node, k): # k rollouts from the same node; games with array states can override this with a vectorized version
+        return [cls.simulate(node) for _ in range(k)]
+
+    def fightAI(self, nodeClass, loadFile=None, trialsPerMove=10, engine=None, ponder=False):
+        if engine is None:
+            engine = MCTS
         if loadFile is None:
-            ai = MCTS(type(self), nodeClass)
+            ai = engine(type(self), nodeClass)
+        elif loadFile.endswith('.tree'):
+            ai = loadTree(loadFile, type(self), nodeClass, self.state.copy(), trialsPerMove=trialsPerMove)
         else:
             if not loadFile.endswith('.pkl'):
                 loadFile += '.pkl'
@@ -111,31 +161,52 @@ class Game:
                 ai = pkl.load(infile)
                 infile.close()
                 ai.trials = trialsPerMove
+        assert not ponder or hasattr(ai, 'startPonder') # ArrayMCTS and MCTSPool only search inside play()
 
         def inp():
             self.printState()
             return int(input('Enter move: '))
 
-        playerInp = inp()
-        winner = self.play(playerInp)
-        ai.root.state = self.state
+        try:
+            playerInp = inp()
+            winner = self.play(playerInp)
+            ai.root.state = self.state
 
-        while winner is None:
-            aiMoveNode, confidence = ai.play(self.state, playerInp)
-            aiMove = aiMoveNode.parentMoveVal
+            while winner is None:
+                aiMoveNode, confidence = ai.play(self.state, playerInp)
+                aiMove = aiMoveNode.parentMoveVal
 
-            print('AI chooses {} | {}% confidence in AI win'.format(aiMove, round(confidence * 100, 2)))
-            winner = self.play(aiMove)
-            if winner is not None:
-                break
+                print('AI chooses {} | {}% confidence in AI win'.format(aiMove, round(confidence * 100, 2)))
+                winner = self.play(aiMove)
+                if winner is not None:
+                    break
 
-            ai.root = aiMoveNode
-            playerInp = inp()
-            winner = self.play(playerInp)
+                ai.root = aiMoveNode
+                if ponder: # keep growing the tree under the player's replies while they think
+                    ai.startPonder()
+                    playerInp = inp()
+                    ai.stopPonder()
+                else:
+                    playerInp = inp()
+                winner = self.play(playerInp)
+        finally: # MCTSPool's worker processes would otherwise live until the interpreter exits
+            if hasattr(ai, 'close'):
+                ai.close()
 
-    def saveAI(self, nodeClass, saveFile, loadFile=None, trialsPretrain=int(1e4), aiPlaysFirst=False):
-        if loadFile is None:
-            ai = MCTS(type(self), nodeClass, trialsPerMove=trialsPretrain)
+    def saveAI(self, nodeClass, saveFile, loadFile=None, trialsPretrain=int(1e4), aiPlaysFirst=False, engine=None, checkpointFile=None, checkpointEvery=10000):
+        if engine is None:
+            engine = MCTS
+        checkpointer = None
+        if checkpointFile is not None:
+            checkpointer = Checkpointer(checkpointFile, checkpointEvery)
+        if checkpointer is not None and checkpointer.exists(): # pick up an interrupted run where its last checkpoint left off
+            ai, trialsDone = resumeCheckpoint(checkpointFile, type(self), nodeClass, engine=engine)
+            ai.trials = max(trialsPretrain - trialsDone, 0)
+            checkpointer.attach(ai, trialsDone)
+        elif loadFile is None:
+            ai = engine(type(self), nodeClass, trialsPerMove=trialsPretrain)
+        elif loadFile.endswith('.tree'):
+            ai = loadTree(loadFile, type(self), nodeClass, self.state.copy(), trialsPerMove=trialsPretrain)
         else:
             if not loadFile.endswith('.pkl'):
                 loadFile += '.pkl'
@@ -144,10 +215,21 @@ class Game:
                 ai.trials = trialsPretrain
                 infile.close()
 
-        ai.root.parentIsAI = aiPlaysFirst
+        if checkpointer is None or getattr(ai, 'checkpointer', None) is None:
+            ai.root.parentIsAI = aiPlaysFirst
+            if checkpointer is not None:
+                checkpointer.attach(ai)
+        ai.earlyStop = False # pretraining should use every trial, not stop once the best first move is settled
 
         _, _ = ai.play(self.state, None) # we just want to save the game tree, we don't want to play any moves so the return values don't matter
+        if checkpointer is not None:
+            checkpointer.save(ai)
+            checkpointer.close()
+            ai.checkpointer = None
 
+        if saveFile.endswith('.tree'):
+            saveTree(ai, saveFile)
+            return
         if not saveFile.endswith('.pkl'):
             saveFile += '.pkl'
         with open(saveFile, 'wb') as outfile:
@@ -155,63 +237,517 @@ class Game:
             outfile.close()
 
 class MCTS:
-    def __init__(self, game, nodeClass, trialsPerMove=1000):
+    checkpoints = True # whether a Checkpointer can be attached, see Checkpointer.attach
+
+    def __init__(self, game, nodeClass, trialsPerMove=1000, numThreads=1, virtualLoss=1, rolloutsPerLeaf=1, timeBudget=None, maxNodes=None, maxBytes=None, solver=False, raveK=None, halving=False):
+        assert virtualLoss >= 1 # with several threads a fresh child holds its virtual loss as plays, so calcUCB never sees 0 plays
+        assert raveK is None or rolloutsPerLeaf == 1 # batched rollouts don't report the moves they played
+        assert not halving or numThreads == 1
+
         self.trials = trialsPerMove
         self.game = game
         self.nodeClass = nodeClass
         self.root = nodeClass()
+        self.numThreads = numThreads
+        self.virtualLoss = virtualLoss
+        self.rolloutsPerLeaf = rolloutsPerLeaf # leaf parallelism: rollouts per expanded child, backpropped together
+        self.timeBudget = timeBudget # seconds per move; trialsPerMove still caps the number of trials
+        self.trialsDone = 0
+        self.budgetUsed = None
+        self.maxNodes = maxNodes # cap on the tree size, low-visit subtrees get evicted past it
+        self.maxBytes = maxBytes # the same cap as an estimated number of bytes
+        self.numNodes = 1
+        self.book = None # set when the tree was loaded from a .tree file
+        self.earlyStop = True # stop once the move play() picks is also the most played one and can't be caught
+        self.solver = solver # MCTS-Solver: prove wins and losses and stop searching them
+        self.raveK = raveK # RAVE: plays at which a node's own value and its AMAF value get equal weight, None turns RAVE off
+        self.halving = halving # sequential halving over the root moves instead of UCB at the root
+        self.survivor = None # the root move left standing by the last halving search
+        self.checkpointer = None
+        self.dirty = None # nodes changed since the last checkpoint, tracked while a checkpointer is attached
+        self.locks = [threading.Lock() for _ in range(64)] # striped, so threads only contend when they touch the same nodes
+        self.ponderThread = None
+        self.ponderStop = False
+        self.pondered = False # the tree was searched while waiting for the player's move
+        self.ponderTrials = 0 # trials the last ponder ran
+        self.ponderBase = {} # visits each reply had when pondering started
+        self.callback = None # called with progress reports during a search, returning True stops it
+        self.interval = 0.5 # seconds between progress reports
+        self.nextReport = 0
+        self.stopSearch = False
+
+    def __getstate__(self): # locks can't be pickled
+        if self.book is not None: # read in the rest of a loaded tree file, a pickle can't point back into it
+            for node in self.iterNodes():
+                self.numNodes += self.book.materialize(node)
+        ret = dict(self.__dict__)
+        del ret['locks']
+        ret['ponderThread'] = None
+        ret['callback'] = None
+        ret['book'] = None
+        ret['checkpointer'] = None
+        ret['dirty'] = None
+        return ret
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.__dict__.setdefault('numThreads', 1)
+        self.__dict__.setdefault('virtualLoss', 1)
+        self.__dict__.setdefault('rolloutsPerLeaf', 1)
+        self.__dict__.setdefault('timeBudget', None)
+        self.__dict__.setdefault('trialsDone', 0)
+        self.__dict__.setdefault('budgetUsed', None)
+        self.__dict__.setdefault('maxNodes', None)
+        self.__dict__.setdefault('maxBytes', None)
+        self.__dict__.setdefault('book', None)
+        self.__dict__.setdefault('earlyStop', True)
+        self.__dict__.setdefault('solver', False)
+        self.__dict__.setdefault('raveK', None)
+        self.__dict__.setdefault('halving', False)
+        self.__dict__.setdefault('survivor', None)
+        self.__dict__.setdefault('checkpointer', None)
+        self.__dict__.setdefault('dirty', None)
+        self.__dict__.setdefault('ponderThread', None)
+        self.__dict__.setdefault('ponderStop', False)
+        self.__dict__.setdefault('pondered', False)
+        self.__dict__.setdefault('ponderTrials', 0)
+        self.__dict__.setdefault('ponderBase', {})
+        self.__dict__.setdefault('callback', None)
+        self.__dict__.setdefault('interval', 0.5)
+        self.__dict__.setdefault('nextReport', 0)
+        self.__dict__.setdefault('stopSearch', False)
+        if 'numNodes' not in self.__dict__:
+            self.numNodes = self.countNodes()
+        self.locks = [threading.Lock() for _ in range(64)]
+
+    def lockFor(self, node, virtualLoss):
+        if virtualLoss:
+            return self.locks[hash(node) % len(self.locks)]
+        return nullcontext()
+
+    def addVirtualLoss(self, node, virtualLoss): # a pending playout counts as a zero-reward play so other threads pick other paths
+        with self.lockFor(node, virtualLoss):
+            node.plays += virtualLoss
+            node.ucbUpdated = False
+
+    def revertVirtualLoss(self, node, virtualLoss):
+        while node is not self.root:
+            with self.lockFor(node, virtualLoss):
+                node.plays -= virtualLoss
+                node.ucbUpdated = False
+            node = node.parent
+
+    def select(self, virtualLoss=0, start=None): # descends from start, the root by default
+        bestNode = self.root if start is None else start
+        while True:
+            if self.book is not None:
+                with self.lockFor(bestNode, virtualLoss):
+                    self.numNodes += self.book.materialize(bestNode)
+            if bestNode.isLeaf():
+                break
 
-    def select(self):
-        bestNode = self.root
-        while not bestNode.isLeaf():
             bestChild = None
             bestUCB = 0
-            for child in bestNode.children:
-                ucbVal = child.calcUCB()
+            for child in bestNode.children.values():
+                if self.solver and child.proven is not None: # nothing left to learn about a solved child
+                    continue
+                ucbVal = child.calcUCB(raveK=self.raveK)
                 if ucbVal > bestUCB or bestChild is None:
                     bestChild = child
                     bestUCB = ucbVal
             if bestChild is None:
-                self.backprop(bestNode, bestNode.isTerminal())
+                if self.solver and len(bestNode.children) > 0: # every child is solved, so bestNode is too
+                    if virtualLoss:
+                        self.revertVirtualLoss(bestNode, virtualLoss)
+                    return None
+                self.backprop(bestNode, bestNode.isTerminal(), virtualLoss)
                 return None
+            if virtualLoss:
+                self.addVirtualLoss(bestChild, virtualLoss)
             ended = bestChild.state.isTerminal()
             if ended is not None:
-                self.backprop(bestChild, ended)
+                if self.solver:
+                    self.prove(bestChild, ended)
+                self.backprop(bestChild, ended, virtualLoss)
                 return None
 
             bestNode = bestChild
         return bestNode
 
-    def expand(self, node): # do a simulation to all children of a node if none are visited
-        childMoves = set()
-        for child in node.children:
-            childMoves.add(child.parentMoveVal)
-
-        validMoves = node.listMoves() - childMoves
-        newMove = random.sample(validMoves, 1)[0]
-        
-        stateClass = type(self.root.state)
-        child = self.nodeClass(newMove, state=stateClass.findState(newMove, node.state), parent=node, children=set(), parentIsAI=(not node.parentIsAI))
-        node.children.add(child)
+    def expand(self, node, virtualLoss=0): # do a simulation to all children of a node if none are visited
+        with self.lockFor(node, virtualLoss):
+            untried = node.untriedMoves()
+            if len(untried) == 0: # another thread expanded the last move since this one selected node
+                return None
+            newMove = untried.pop()
+
+            stateClass = type(self.root.state)
+            child = self.nodeClass(newMove, state=stateClass.findState(newMove, node.state), parent=node, parentIsAI=(not node.parentIsAI))
+            child.plays = virtualLoss
+            evicted = getattr(node, 'evicted', None)
+            if evicted is not None and newMove in evicted: # start from the stats the child had before it was evicted
+                wins, plays = evicted.pop(newMove)
+                child.wins += wins
+                child.plays += plays
+            node.children[newMove] = child
+            self.numNodes += 1
+        if self.solver:
+            ended = child.state.isTerminal()
+            if ended is not None:
+                self.prove(child, ended)
         return child
 
-    def backprop(self, node, won):
+    def prove(self, node, ended): # marks a terminal node won, lost or drawn, then passes what that settles up the tree
+        mine = self.game.calcReward(node, ended)
+        theirs = self.game.calcReward(RewardProbe(not node.parentIsAI), ended)
+        if mine > theirs:
+            node.proven = provenWin
+        elif mine < theirs:
+            node.proven = provenLoss
+        else:
+            node.proven = provenDraw
+
+        while node is not self.root and node.parent is not None:
+            parent = node.parent
+            if parent.proven is not None:
+                break
+            if node.proven == provenWin: # the player to move at parent can win by moving to node
+                parent.proven = provenLoss
+            elif parent.isLeaf(): # an untried move could still do better
+                break
+            else:
+                results = [child.proven for child in parent.children.values()]
+                if None in results:
+                    break
+                if all(result == provenLoss for result in results):
+                    parent.proven = provenWin
+                else:
+                    parent.proven = provenDraw # no winning move, but at least one that holds the draw
+            node = parent
+
+    def backprop(self, node, won, virtualLoss=0, moves=None):
+        if moves is not None:
+            self.backpropAMAF(node, won, moves, virtualLoss)
         while node is not None:
             outcome = self.game.calcReward(node, won)
-            node.wins += outcome
-            node.plays += 1
-            node.ucbUpdated = False
+            with self.lockFor(node, virtualLoss):
+                node.wins += outcome
+                node.plays += 1
+                node.ucbUpdated = False
+                if virtualLoss and node is not self.root:
+                    node.plays -= virtualLoss
+            if self.dirty is not None:
+                self.dirty.add(node)
+            if virtualLoss and node is self.root: # the old tree above the root was never given virtual loss
+                break
             node = node.parent
 
-    def play(self, state, playerMove=None):
-        if playerMove is not None and len(self.root.children) > 0:
-            self.root = self.root.findChild(playerMove)
-            #self.root = self.nodeClass(state=state, children=set())
-        if self.root is None:
-            self.root = self.nodeClass(state=state, children=set())
+    def backpropBatch(self, node, outcomes, virtualLoss=0): # one pass up the tree for all of a leaf's rollouts
+        outcomes, counts = np.unique(np.asarray(outcomes), return_counts=True)
+        plays = int(np.sum(counts))
+        while node is not None:
+            reward = 0
+            for outcome, count in zip(outcomes, counts):
+                reward += self.game.calcReward(node, outcome) * int(count)
+            with self.lockFor(node, virtualLoss):
+                node.wins += reward
+                node.plays += plays
+                node.ucbUpdated = False
+                if virtualLoss and node is not self.root:
+                    node.plays -= virtualLoss
+            if self.dirty is not None:
+                self.dirty.add(node)
+            if virtualLoss and node is self.root:
+                break
+            node = node.parent
+
+    def backpropAMAF(self, node, won, moves, virtualLoss=0): # credits every child whose move its player went on to make later in the trial
+        played = set(moves)
+        while node is not None:
+            for child in node.children.values():
+                if (child.parentMoveVal, child.parentIsAI) in played:
+                    with self.lockFor(child, virtualLoss):
+                        child.amafWins += self.game.calcReward(child, won)
+                        child.amafPlays += 1
+                        child.ucbUpdated = False
+            if node is self.root:
+                break
+            played.add((node.parentMoveVal, node.parentIsAI))
+            node = node.parent
+
+    def rollout(self, node): # returns the outcome, plus the moves played when RAVE needs them
+        if self.rolloutsPerLeaf > 1:
+            return self.game.simulateBatch(node, self.rolloutsPerLeaf), None
+        if self.raveK is not None:
+            moves = []
+            return self.game.simulate(node, moves), moves
+        return self.game.simulate(node), None
+
+    def backpropRollout(self, node, won, virtualLoss=0, moves=None):
+        if self.rolloutsPerLeaf > 1:
+            self.backpropBatch(node, won, virtualLoss)
+        else:
+            self.backprop(node, won, virtualLoss, moves)
 
+    def iterNodes(self): # every node under the root, parents before children
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+    def countNodes(self):
+        ret = 0
+        for node in self.iterNodes():
+            ret += 1
+        return ret
+
+    def nodeBytes(self): # rough size of one node and its state, measured on the root
+        node = self.root
+        state = node.state
+        ret = sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof({}) + sys.getsizeof(node.untriedMoves())
+        ret += sys.getsizeof(state) + sys.getsizeof(getattr(state, '__dict__', {})) + sys.getsizeof(state.state)
+        return ret
+
+    def memoryUsage(self): # (nodes, estimated bytes) of the tree under the root
+        return self.numNodes, self.numNodes * self.nodeBytes()
+
+    def nodeCap(self):
+        cap = self.maxNodes
+        if self.maxBytes is not None:
+            byteCap = self.maxBytes // self.nodeBytes()
+            cap = byteCap if cap is None else min(cap, byteCap)
+        return cap
+
+    def setRoot(self, node): # cuts the new root off from the old tree, so everything outside its subtree can be freed
+        self.root = node
+        if node is not None:
+            node.parent = None
+            self.numNodes = self.countNodes()
+
+    def evict(self, target, keep=()): # drops the least visited subtrees until at most target nodes are left, never one of the nodes in keep
+        keep = {id(node) for node in keep}
+        order = [self.root]
+        for node in order: # breadth-first, so every node comes after its parent
+            order.extend(node.children.values())
+        sizes = {}
+        for node in reversed(order):
+            sizes[id(node)] = 1 + sum(sizes[id(child)] for child in node.children.values())
+
+        evicted = set()
+        for node in sorted(order[1:], key=lambda node: node.plays):
+            if self.numNodes <= target:
+                break
+            if id(node) in keep: # the caller is still searching under it, though its own subtree can be thinned
+                continue
+            ancestor = node.parent
+            while ancestor is not None and id(ancestor) not in evicted:
+                ancestor = ancestor.parent
+            if ancestor is not None: # already gone with an evicted ancestor
+                continue
+
+            parent = node.parent
+            ancestor = parent
+            while ancestor is not None: # so evicting an ancestor later doesn't count this subtree twice
+                sizes[id(ancestor)] -= sizes[id(node)]
+                ancestor = ancestor.parent
+            parent.removeChild(node)
+            if getattr(parent, 'evicted', None) is None:
+                parent.evicted = {}
+            parent.evicted[node.parentMoveVal] = (node.wins, node.plays) # the parent keeps the child's stats for when it's expanded again
+            node.parent = None
+            evicted.add(id(node))
+            self.numNodes -= sizes[id(node)]
+
+    def checkMemory(self, keep=()):
+        cap = self.nodeCap()
+        if cap is not None and self.numNodes > cap:
+            self.evict(int(cap * 0.9), keep) # leave some room so eviction doesn't run again right away
+
+    def searchDone(self, start, timeBudget): # out of time, or the move play() picks is the most played one and can't be caught in the trials left
+        if self.stopSearch:
+            return True
+        elapsed = time.time() - start
+        left = self.trials - self.trialsDone
+        if timeBudget is not None:
+            if elapsed >= timeBudget:
+                return True
+            left = min(left, self.trialsDone / elapsed * (timeBudget - elapsed))
+
+        if not self.earlyStop:
+            return left <= 0
+        children = self.rootChildren()
+        if len(children) < 2 or self.root.isLeaf(): # an unexpanded move could still turn out best
+            return False
+        plays = sorted((child.plays for child in children.values()), reverse=True)
+        move, best = self.pickMove(children)
+        return best.plays == plays[0] and plays[0] - plays[1] > left * self.rolloutsPerLeaf # only settled if play() would take the move too
+
+    def progress(self, start): # the search so far: the root move play() would pick, its share of the visits, principal variation and speed
+        elapsed = time.time() - start
+        children = self.rootChildren()
+        move, best = self.pickMove(children)
+        pv = []
+        node = best
+        while node is not None: # the most played replies below play()'s pick
+            pv.append(move)
+            replies = list(node.children.items())
+            if len(replies) == 0:
+                break
+            move, node = max(replies, key=lambda item: item[1].plays)
+
+        ret = {'move': None, 'share': 0, 'winRatio': 0, 'pv': pv, 'trials': self.trialsDone, 'seconds': elapsed,
+            'playoutsPerSec': self.trialsDone / elapsed if elapsed > 0 else 0}
+        if best is not None:
+            ret['move'] = pv[0]
+            ret['share'] = best.plays / max(sum(child.plays for child in children.values()), 1)
+            ret['winRatio'] = best.wins / max(best.plays, 1)
+        return ret
+
+    def report(self, start, force=False): # only called every 64 trials, and the callback only every interval seconds
+        if self.callback is None or (not force and time.time() < self.nextReport):
+            return
+        self.nextReport = time.time() + self.interval
+        if self.callback(self.progress(start)):
+            self.stopSearch = True
+
+    def reportBudget(self, start, timeBudget):
+        elapsed = time.time() - start
+        used = self.trialsDone / max(self.trials, 1) # pondering can leave no trials to run
+        if timeBudget is not None:
+            used = max(used, elapsed / timeBudget)
+        self.budgetUsed = {'trials': self.trialsDone, 'seconds': elapsed, 'fraction': min(used, 1)}
+        print('Used {}% of the budget | {} trials in {}s'.format(round(self.budgetUsed['fraction'] * 100, 1), self.trialsDone, round(elapsed, 3)))
+
+    def searchThread(self, trials, start, timeBudget, reports=False):
+        for i in range(trials):
+            if i & 63 == 0 and i > 0:
+                if self.searchDone(start, timeBudget):
+                    break
+                if reports:
+                    self.report(start)
+            if self.root.proven is not None:
+                break
+            bestNode = self.select(self.virtualLoss)
+            if type(bestNode) is self.nodeClass:
+                child = self.expand(bestNode, self.virtualLoss)
+                if child is None:
+                    self.revertVirtualLoss(bestNode, self.virtualLoss)
+                    continue
+                won, moves = self.rollout(child)
+                self.backpropRollout(child, won, self.virtualLoss, moves)
+            self.trialsDone += 1 # unlocked, so the count can be slightly off; it's only used for budgeting
+
+    def searchParallel(self, start, timeBudget): # tree parallelism: every thread descends the same tree
+        threads = []
+        for i in range(self.numThreads):
+            trials = self.trials // self.numThreads + (i < self.trials % self.numThreads)
+            threads.append(threading.Thread(target=self.searchThread, args=(trials, start, timeBudget, i == 0))) # one thread reports progress for all
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        print('{} threads | {} playouts/sec'.format(self.numThreads, round(self.trialsDone / elapsed)))
+
+    def search(self, timeBudget=None, callback=None, interval=None):
+        if timeBudget is None:
+            timeBudget = self.timeBudget
+        searchStart = time.time()
+        self.trialsDone = 0
+        self.callback = callback
+        if interval is not None:
+            self.interval = interval
+        self.nextReport = searchStart + self.interval
+
+        try:
+            if self.numThreads > 1: # evicting while other threads walk the tree isn't safe, so the cap is only enforced between searches
+                self.checkMemory()
+                self.searchParallel(searchStart, timeBudget)
+            elif self.halving:
+                self.searchHalving(searchStart, timeBudget)
+            else:
+                self.searchSerial(searchStart, timeBudget)
+            self.checkMemory()
+            self.report(searchStart, force=True)
+            self.reportBudget(searchStart, timeBudget)
+        finally:
+            self.callback = None
+            self.stopSearch = False # a stop request only ends the search it came in during
+
+    def searchHalving(self, searchStart, timeBudget): # sequential halving: equal trials for every root move, then drop the worse half, until one is left
+        self.survivor = None
+        while self.root.isLeaf(): # every root move gets its share from the first round on
+            child = self.expand(self.root)
+            won, moves = self.rollout(child)
+            self.backpropRollout(child, won, moves=moves)
+            self.trialsDone += 1
+
+        candidates = [child for child in self.root.children.values() if not (self.solver and child.proven == provenLoss)]
+        if len(candidates) == 0:
+            candidates = list(self.root.children.values())
+        rounds = max(int(np.ceil(np.log2(len(candidates)))), 1)
+        while len(candidates) > 1:
+            if self.solver:
+                won = [child for child in candidates if child.proven == provenWin]
+                if len(won) > 0:
+                    candidates = won[:1]
+                    break
+            left = self.trials - self.trialsDone
+            perChild = max(left // (len(candidates) * rounds), 1)
+            rounds = max(rounds - 1, 1)
+            stopped = False
+            for child in candidates:
+                for i in range(perChild):
+                    if self.trialsDone & 63 == 0:
+                        if self.stopSearch or (timeBudget is not None and time.time() - searchStart >= timeBudget):
+                            stopped = True # out of budget, so no other candidate gets its share of this round either
+                            break
+                        self.checkMemory(keep=candidates) # an evicted candidate's trials would go to a subtree cut off from the root
+                        self.report(searchStart)
+                    ended = child.state.isTerminal() # select only checks the nodes it descends into, not the one it starts from
+                    if ended is not None:
+                        if self.solver:
+                            self.prove(child, ended)
+                        self.backprop(child, ended)
+                    else:
+                        bestNode = self.select(start=child)
+                        if type(bestNode) is self.nodeClass:
+                            leaf = self.expand(bestNode)
+                            won, moves = self.rollout(leaf)
+                            self.backpropRollout(leaf, won, moves=moves)
+                    self.trialsDone += 1
+                    if child.proven is not None:
+                        break
+                if stopped:
+                    break
+
+            if stopped: # a round cut short gave the candidates unequal shares, so don't halve on it
+                break
+            if self.solver: # a move proven lost this round can't win the next one
+                notLost = [child for child in candidates if child.proven != provenLoss]
+                if len(notLost) > 0:
+                    candidates = notLost
+            candidates.sort(key=self.rank, reverse=True)
+            candidates = candidates[:(len(candidates) + 1) // 2]
+            if self.stopSearch or self.trialsDone >= self.trials or (timeBudget is not None and time.time() - searchStart >= timeBudget):
+                break
+        if len(candidates) > 0:
+            self.survivor = max(candidates, key=self.rank)
+
+    def searchSerial(self, searchStart, timeBudget):
         times = {'select': 0, 'expand': 0, 'simulate': 0, 'backprop': 0}
         for i in tqdm(range(self.trials)):
+            if i & 63 == 0 and i > 0: # checked every 64 trials to keep the loop cheap
+                if self.searchDone(searchStart, timeBudget):
+                    break
+                self.checkMemory()
+                if self.checkpointer is not None:
+                    self.checkpointer.maybeSave(self)
+                self.report(searchStart)
+            if self.root.proven is not None: # solved, more trials can't change the answer
+                break
             start = time.time()
             bestNode = self.select()
             times['select'] += time.time() - start
@@ -221,22 +757,352 @@ class MCTS:
                 times['expand'] += time.time() - start
 
                 start = time.time()
-                won = self.game.simulate(child)
+                won, moves = self.rollout(child)
                 times['simulate'] += time.time() - start
 
                 start = time.time()
-                self.backprop(child, won)
+                self.backpropRollout(child, won, moves=moves)
                 times['backprop'] += time.time() - start
+            self.trialsDone += 1
         print(times)
 
-        bestChild = None
-        bestWinRatio = 0
+    def ponder(self): # runs trials from the current root until stopPonder is called
+        i = 0
+        while not self.ponderStop and self.root.proven is None:
+            if i & 63 == 0 and i > 0:
+                self.checkMemory()
+            bestNode = self.select()
+            if type(bestNode) is self.nodeClass:
+                child = self.expand(bestNode)
+                if child is None:
+                    continue
+                won, moves = self.rollout(child)
+                self.backpropRollout(child, won, moves=moves)
+            i += 1
+        self.ponderTrials = i
+        print('Pondered {} trials'.format(i))
+
+    def startPonder(self): # search in the background while the player thinks, the root is the position they move from
+        self.ponderStop = False
+        self.ponderTrials = 0
+        self.ponderBase = {move: child.plays for move, child in self.rootChildren().items()}
+        self.ponderThread = threading.Thread(target=self.ponder, daemon=True)
+        self.ponderThread.start()
+
+    def stopPonder(self):
+        self.ponderStop = True
+        self.ponderThread.join()
+        self.ponderThread = None
+        self.pondered = True
+
+    def ponderCredit(self, playerMove): # trials pondering added under the player's actual move, which is the root by now
+        if not self.pondered:
+            return 0
+        self.pondered = False
+        return min(self.root.plays - self.ponderBase.get(playerMove, 0), self.ponderTrials)
+
+    def rootChildren(self): # a copy, since search threads may be adding to the root's children while it's read
+        with self.lockFor(self.root, True):
+            return dict(self.root.children)
+
+    def rank(self, child): # how play() orders the root moves
+        winRatio = child.wins / max(child.plays, 1)
+        if self.solver and child.proven is not None: # a proven win always beats an estimate, a proven loss never does
+            return {provenWin: np.inf, provenDraw: winRatio, provenLoss: -np.inf}[child.proven]
+        return winRatio
+
+    def pickMove(self, children=None): # (move, child) that play() returns, (None, None) while the root has no children
+        if children is None:
+            children = self.rootChildren()
+        survivor = self.survivor
+        if self.halving and survivor is not None and children.get(survivor.parentMoveVal) is survivor and self.rank(survivor) > -np.inf:
+            return survivor.parentMoveVal, survivor # a move halved away early may show a lucky ratio over a few plays
+        bestMove = bestChild = None
+        bestRank = 0
+        for move, child in children.items():
+            rank = self.rank(child)
+            if bestChild is None or rank > bestRank:
+                bestMove, bestChild, bestRank = move, child, rank
+        return bestMove, bestChild
+
+    def childStats(self): # raw per-move totals, so results from several trees can be merged by visits
+        ret = {}
+        for move, child in self.rootChildren().items():
+            ret[move] = (child.wins, child.plays)
+        return ret
+
+    def advance(self, move): # moves the root down to the child reached by move, keeping its subtree
+        if self.book is not None:
+            self.numNodes += self.book.materialize(self.root)
+        child = self.root.findChild(move)
+        if child is None:
+            stateClass = type(self.root.state)
+            child = self.nodeClass(move, state=stateClass.findState(move, self.root.state), parentIsAI=(not self.root.parentIsAI))
+        self.setRoot(child)
+
+    def play(self, state, playerMove=None, timeBudget=None, callback=None, interval=None):
+        if self.book is not None:
+            self.numNodes += self.book.materialize(self.root)
+        if playerMove is not None:
+            self.root = self.root.findChild(playerMove) # None if the player's move was never expanded
+        if self.root is None:
+            self.root = self.nodeClass(state=state)
+        self.setRoot(self.root)
 
-        for child in self.root.children:
-            winRatio = child.wins / child.plays
-            if bestChild is None or winRatio > bestWinRatio:
-                bestChild = child
-                bestWinRatio = winRatio
+        trials = self.trials
+        self.trials = max(trials - self.ponderCredit(playerMove), 0) # trials pondered under the player's actual move count toward this search
+        try:
+            self.search(timeBudget, callback, interval)
+        finally:
+            self.trials = trials
 
+        _, bestChild = self.pickMove()
+        bestWinRatio = bestChild.wins / bestChild.plays
+        if bestChild.proven is not None:
+            print('Proven {} for the AI'.format({provenWin: 'win', provenDraw: 'draw', provenLoss: 'loss'}[bestChild.proven]))
         print('Best Child\'s number of plays:', bestChild.plays)
         return bestChild, bestWinRatio
+
+    def iterPlay(self, state, playerMove=None, timeBudget=None, interval=None): # play as a generator of progress reports, the last one holding play's result
+        updates = queue.Queue()
+        stopped = threading.Event()
+
+        def callback(info):
+            updates.put(info)
+            return stopped.is_set()
+
+        def run():
+            try:
+                updates.put({'result': self.play(state, playerMove, timeBudget, callback, interval)})
+            except BaseException as e:
+                updates.put({'error': e})
+
+        self.stopSearch = False
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                info = updates.get()
+                if 'error' in info:
+                    raise info['error']
+                yield info
+                if 'result' in info:
+                    break
+        finally: # the caller stopped iterating, so wind the search down and play the best move found so far
+            stopped.set()
+            self.stopSearch = True # set even if the search hasn't started yet, it stops as soon as it does
+            thread.join()
+            self.stopSearch = False
+
+class Checkpointer: # appends what changed in the tree since the last checkpoint to a file, written from a background thread
+    def __init__(self, checkpointFile, every=10000):
+        self.checkpointFile = checkpointFile
+        self.every = every
+        self.trialsBefore = 0 # trials from earlier runs that this one resumed
+        self.lastSaved = 0
+        self.nextId = 0
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self.write, daemon=True)
+        self.writer.start()
+
+    def exists(self):
+        return os.path.exists(self.checkpointFile) and os.path.getsize(self.checkpointFile) > 0
+
+    def attach(self, ai, trialsDone=0):
+        # only the serial search writes checkpoints, and resuming replays it exactly only if no subtree was evicted in between
+        assert getattr(ai, 'checkpoints', False) and ai.numThreads == 1 and not ai.halving and ai.nodeCap() is None
+        ai.checkpointer = self
+        self.trialsBefore = trialsDone
+        self.lastSaved = 0
+        for node in ai.iterNodes():
+            if getattr(node, 'nodeId', None) is not None:
+                self.nextId = max(self.nextId, node.nodeId + 1)
+        if trialsDone == 0: # a fresh run starts with the whole tree
+            ai.dirty = set(ai.iterNodes())
+        else:
+            ai.dirty = set()
+
+    def assignId(self, node): # new nodes are numbered parents first, so a checkpoint lists every parent before its children
+        missing = []
+        while node is not None and getattr(node, 'nodeId', None) is None:
+            missing.append(node)
+            node = node.parent
+        for node in reversed(missing):
+            node.nodeId = self.nextId
+            self.nextId += 1
+
+    def maybeSave(self, ai):
+        if ai.trialsDone - self.lastSaved >= self.every:
+            self.save(ai)
+
+    def save(self, ai): # the stats are copied here, on the search thread, so the writer sees a consistent snapshot
+        changed = set(ai.dirty)
+        for node in ai.dirty: # selection recomputes the cached UCB of every child of a node it walks through
+            changed.update(node.children.values())
+        for node in changed:
+            self.assignId(node)
+        nodes = []
+        for node in sorted(changed, key=lambda node: node.nodeId):
+            parentId = -1 if node.parent is None else node.parent.nodeId
+            untried = None if node.untried is None else list(node.untried)
+            extra = {'ucb': node.ucb, 'ucbUpdated': node.ucbUpdated, 'untried': untried, 'proven': node.proven, 'amafWins': node.amafWins, 'amafPlays': node.amafPlays,
+                'order': list(node.children)} # selection breaks UCB ties by child order
+            nodes.append((node.nodeId, parentId, node.parentMoveVal, node.parentIsAI, node.wins, node.plays, extra))
+        ai.dirty = set()
+        self.lastSaved = ai.trialsDone
+
+        record = {'trials': self.trialsBefore + ai.trialsDone, 'nodes': nodes, 'random': random.getstate(), 'numpy': npr.get_state()}
+        self.queue.put(record)
+
+    def write(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            with open(self.checkpointFile, 'ab') as outfile:
+                pkl.dump(record, outfile)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+
+def resumeCheckpoint(checkpointFile, game, nodeClass, engine=None, trialsPerMove=1000): # rebuilds the tree and RNG state from a checkpoint file
+    if engine is None:
+        engine = MCTS
+    records = []
+    with open(checkpointFile, 'rb') as infile:
+        while True:
+            try:
+                records.append(pkl.load(infile))
+            except (EOFError, pkl.UnpicklingError): # a crash can leave a half-written record at the end
+                break
+    if len(records) == 0:
+        raise ValueError('{} has no complete checkpoint'.format(checkpointFile))
+
+    ai = engine(game, nodeClass, trialsPerMove=trialsPerMove)
+    nodes = {}
+    orders = {}
+    for record in records:
+        for nodeId, parentId, move, parentIsAI, wins, plays, *extra in record['nodes']: # checkpoints from before the extra fields have six
+            node = nodes.get(nodeId)
+            if node is None:
+                if parentId == -1:
+                    node = ai.root
+                    node.parentIsAI = parentIsAI
+                else:
+                    parent = nodes[parentId]
+                    stateClass = type(parent.state)
+                    node = nodeClass(move, state=stateClass.findState(move, parent.state), parent=parent, parentIsAI=parentIsAI)
+                    parent.addChild(node)
+                node.nodeId = nodeId
+                nodes[nodeId] = node
+            node.wins = wins
+            node.plays = plays
+            if len(extra) > 0: # cached UCB and untried order too, so the resumed search takes the same paths
+                extra = dict(extra[0])
+                orders[nodeId] = extra.pop('order')
+                node.__dict__.update(extra)
+
+    for nodeId, order in orders.items():
+        children = nodes[nodeId].children
+        nodes[nodeId].children = {**{move: children[move] for move in order if move in children}, **children}
+
+    random.setstate(records[-1]['random'])
+    npr.set_state(records[-1]['numpy'])
+    ai.numNodes = len(nodes)
+    return ai, records[-1]['trials']
+
+# flat binary tree files: a header, then one array per node field with the nodes in breadth-first order,
+# so that every node's children sit in one contiguous block
+treeMagic = b'MCTSTREE'
+treeVersion = 1
+treeFields = (('move', np.int64), ('wins', np.float64), ('plays', np.int64), ('firstChild', np.int64), ('numChildren', np.int64))
+
+def saveTree(ai, saveFile):
+    order = [ai.root]
+    for node in order:
+        if ai.book is not None: # parts of a loaded tree may never have been read in
+            ai.numNodes += ai.book.materialize(node)
+        order.extend(node.children.values())
+
+    n = len(order)
+    arrays = {name: np.zeros(n, dtype=dtype) for name, dtype in treeFields}
+    arrays['firstChild'][:] = -1
+    nextIdx = 1
+    for idx, node in enumerate(order):
+        arrays['move'][idx] = node.parentMoveVal if node.parentMoveVal is not None else -1
+        arrays['wins'][idx] = node.wins
+        arrays['plays'][idx] = node.plays
+        if len(node.children) > 0:
+            arrays['firstChild'][idx] = nextIdx
+            arrays['numChildren'][idx] = len(node.children)
+            nextIdx += len(node.children)
+
+    gameName = ai.game.__name__.encode()
+    nodeName = ai.nodeClass.__name__.encode()
+    header = treeMagic + struct.pack('<IHH?', treeVersion, len(gameName), len(nodeName), ai.root.parentIsAI) + gameName + nodeName
+    header += b'\0' * (-(len(header) + 8) % 8) + struct.pack('<Q', n) # pad so the arrays are 8-byte aligned
+    with open(saveFile, 'wb') as outfile:
+        outfile.write(header)
+        for name, dtype in treeFields:
+            outfile.write(arrays[name].tobytes())
+
+class TreeBook: # a memory-mapped tree file that hands out nodes only as the search reaches them
+    def __init__(self, loadFile, game, nodeClass):
+        with open(loadFile, 'rb') as infile:
+            head = infile.read(len(treeMagic) + 9)
+            if head[:len(treeMagic)] != treeMagic:
+                raise ValueError('{} is not a tree file'.format(loadFile))
+            version, gameLen, nodeLen, self.rootParentIsAI = struct.unpack('<IHH?', head[len(treeMagic):])
+            if version != treeVersion:
+                raise ValueError('{} has tree format version {}, expected {}'.format(loadFile, version, treeVersion))
+            gameName = infile.read(gameLen).decode()
+            nodeName = infile.read(nodeLen).decode()
+            if gameName != game.__name__ or nodeName != nodeClass.__name__:
+                raise ValueError('{} holds a {}/{} tree, not {}/{}'.format(loadFile, gameName, nodeName, game.__name__, nodeClass.__name__))
+            offset = len(head) + gameLen + nodeLen
+            offset += -(offset + 8) % 8
+            infile.seek(offset)
+            n, = struct.unpack('<Q', infile.read(8))
+            offset += 8
+
+        self.nodeClass = nodeClass
+        self.size = n
+        for name, dtype in treeFields:
+            setattr(self, name, np.memmap(loadFile, dtype=dtype, mode='r', offset=offset, shape=(n,)))
+            offset += n * np.dtype(dtype).itemsize
+
+    def makeRoot(self, state):
+        root = self.nodeClass(state=state, parentIsAI=self.rootParentIsAI)
+        root.wins = float(self.wins[0])
+        root.plays = int(self.plays[0])
+        root.bookIdx = 0
+        self.materialize(root)
+        return root
+
+    def materialize(self, node): # reads in a node's children the first time the node is reached, returning how many it added
+        idx = getattr(node, 'bookIdx', None)
+        if idx is None:
+            return 0
+        node.bookIdx = None
+
+        stateClass = type(node.state)
+        start = int(self.firstChild[idx])
+        for childIdx in range(start, start + int(self.numChildren[idx])):
+            move = int(self.move[childIdx])
+            child = self.nodeClass(move, state=stateClass.findState(move, node.state), parent=node, parentIsAI=(not node.parentIsAI))
+            child.wins = float(self.wins[childIdx])
+            child.plays = int(self.plays[childIdx])
+            child.bookIdx = childIdx
+            node.addChild(child)
+        return int(self.numChildren[idx])
+
+def loadTree(loadFile, game, nodeClass, state, trialsPerMove=1000):
+    book = TreeBook(loadFile, game, nodeClass)
+    ai = MCTS(game, nodeClass, trialsPerMove=trialsPerMove)
+    ai.book = book
+    ai.root = book.makeRoot(state)
+    ai.numNodes = 1 + len(ai.root.children)
+    return ai
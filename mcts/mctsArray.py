@@ -0,0 +1,239 @@
+# array-backed MCTS: the tree lives in growable numpy arrays instead of one Node object per position
+
+from mcts import *
+
+class ArrayTree:
+    fields = (('wins', np.float64, 0), ('plays', np.int64, 0), ('parent', np.int64, -1), ('move', np.int64, 0),
+        ('firstChild', np.int64, -1), ('numChildren', np.int64, 0), ('parentIsAI', np.bool_, False))
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        for name, dtype, fill in ArrayTree.fields:
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+
+    def capacity(self):
+        return len(self.wins)
+
+    def grow(self, needed):
+        capacity = self.capacity()
+        while capacity < needed:
+            capacity *= 2
+        for name, dtype, fill in ArrayTree.fields:
+            arr = np.full(capacity, fill, dtype=dtype)
+            arr[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, arr)
+
+    def alloc(self, n): # returns the index of the first of n fresh, contiguous nodes
+        if self.size + n > self.capacity():
+            self.grow(self.size + n)
+        start = self.size
+        self.size += n
+        return start
+
+    def addRoot(self, parentIsAI=False):
+        idx = self.alloc(1)
+        self.parentIsAI[idx] = parentIsAI
+        return idx
+
+    def addChildren(self, idx, moves): # all children of a node are allocated at once so they sit in one block
+        n = len(moves)
+        start = self.alloc(n)
+        end = start + n
+        self.move[start:end] = moves
+        self.parent[start:end] = idx
+        self.parentIsAI[start:end] = not self.parentIsAI[idx]
+        self.firstChild[idx] = start
+        self.numChildren[idx] = n
+        return start
+
+    def children(self, idx):
+        start = self.firstChild[idx]
+        return start, start + self.numChildren[idx]
+
+    def findChild(self, idx, move):
+        start, end = self.children(idx)
+        hits = np.nonzero(self.move[start:end] == move)[0]
+        if len(hits) == 0:
+            return -1
+        return start + int(hits[0])
+
+    def subtree(self, idx): # copy of the subtree under idx, renumbered breadth-first so child blocks stay contiguous
+        order = [idx]
+        i = 0
+        while i < len(order):
+            node = order[i]
+            if self.numChildren[node] > 0:
+                start, end = self.children(node)
+                order.extend(range(start, end))
+            i += 1
+
+        oldIdx = np.array(order, dtype=np.int64)
+        newIdx = np.full(self.size, -1, dtype=np.int64)
+        newIdx[oldIdx] = np.arange(len(oldIdx))
+
+        ret = ArrayTree(max(len(oldIdx), 1024))
+        ret.size = len(oldIdx)
+        for name, dtype, fill in ArrayTree.fields:
+            getattr(ret, name)[:ret.size] = getattr(self, name)[oldIdx]
+
+        ret.parent[0] = -1
+        ret.parent[1:ret.size] = newIdx[ret.parent[1:ret.size]]
+        hasChildren = ret.firstChild[:ret.size] >= 0
+        ret.firstChild[:ret.size][hasChildren] = newIdx[ret.firstChild[:ret.size][hasChildren]]
+        return ret
+
+    def __getstate__(self): # don't pickle the unused capacity
+        ret = dict(self.__dict__)
+        for name, dtype, fill in ArrayTree.fields:
+            ret[name] = ret[name][:self.size].copy()
+        return ret
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.grow(max(self.size, 1024))
+
+class ArrayMCTS: # drop-in for MCTS, e.g. ttt.fightAI(TTTNode, engine=ArrayMCTS)
+    def __init__(self, game, nodeClass, trialsPerMove=1000, c=2**0.5):
+        self.trials = trialsPerMove
+        self.game = game
+        self.nodeClass = nodeClass
+        self.c = c
+        self.tree = ArrayTree()
+        self.tree.addRoot()
+        self.rootNode = nodeClass()
+        self.rootNode.treeIdx = 0
+
+    @property
+    def root(self): # a Node holding the root position, so game code can read and replace it as with MCTS
+        return self.rootNode
+
+    @root.setter
+    def root(self, node):
+        idx = getattr(node, 'treeIdx', None)
+        if idx is not None and idx != 0:
+            self.tree = self.tree.subtree(idx)
+        elif idx is None:
+            self.tree = ArrayTree()
+            self.tree.addRoot(node.parentIsAI)
+        node.treeIdx = 0
+        self.rootNode = node
+
+    def makeNode(self, idx, state):
+        tree = self.tree
+        node = self.nodeClass(int(tree.move[idx]), state=state, parentIsAI=bool(tree.parentIsAI[idx]))
+        node.wins = tree.wins[idx]
+        node.plays = tree.plays[idx]
+        node.treeIdx = idx
+        return node
+
+    def calcUCB(self, idx):
+        tree = self.tree
+        start, end = tree.children(idx)
+        wins = tree.wins[start:end]
+        plays = tree.plays[start:end]
+        return wins / plays + self.c * (np.log(tree.plays[idx]) / plays) ** 0.5
+
+    def isLeaf(self, idx): # unexpanded, or some child hasn't been played yet
+        start, end = self.tree.children(idx)
+        return start < 0 or not np.all(self.tree.plays[start:end] > 0)
+
+    def select(self): # returns the path to the node to expand along with its state, or None if the trial hit a terminal state
+        tree = self.tree
+        state = self.rootNode.state.copy()
+        path = [0]
+        idx = 0
+        while not self.isLeaf(idx):
+            idx = tree.firstChild[idx] + int(np.argmax(self.calcUCB(idx)))
+            path.append(idx)
+            state.update(int(tree.move[idx]))
+            ended = state.isTerminal()
+            if ended is not None:
+                self.backprop(path, ended)
+                return None
+        return path, state
+
+    def expand(self, path, state):
+        tree = self.tree
+        idx = path[-1]
+        if tree.numChildren[idx] == 0:
+            moves = tuple(self.makeNode(idx, state).listMoves())
+            if len(moves) == 0:
+                self.backprop(path, state.isTerminal())
+                return None
+            tree.addChildren(idx, moves)
+
+        start, end = tree.children(idx)
+        untried = np.nonzero(tree.plays[start:end] == 0)[0]
+        child = start + int(untried[random.randrange(len(untried))])
+        path.append(child)
+        state.update(int(tree.move[child]))
+        return self.makeNode(child, state)
+
+    def backprop(self, path, won):
+        tree = self.tree
+        path = np.array(path, dtype=np.int64)
+        rewardAI = self.game.calcReward(RewardProbe(True), won)
+        rewardPlayer = self.game.calcReward(RewardProbe(False), won)
+        tree.wins[path] += np.where(tree.parentIsAI[path], rewardAI, rewardPlayer)
+        tree.plays[path] += 1
+
+    def childStats(self):
+        tree = self.tree
+        ret = {}
+        start, end = tree.children(0)
+        for idx in range(start, end):
+            if tree.plays[idx] > 0:
+                ret[int(tree.move[idx])] = (tree.wins[idx], tree.plays[idx])
+        return ret
+
+    def advance(self, move):
+        stateClass = type(self.rootNode.state)
+        idx = self.tree.findChild(0, move)
+        if idx >= 0:
+            self.root = self.makeNode(idx, stateClass.findState(move, self.rootNode.state))
+        else:
+            self.root = self.nodeClass(move, state=stateClass.findState(move, self.rootNode.state), parentIsAI=(not self.rootNode.parentIsAI))
+
+    def search(self):
+        times = {'select': 0, 'expand': 0, 'simulate': 0, 'backprop': 0}
+        for i in tqdm(range(self.trials)):
+            start = time.time()
+            selected = self.select()
+            times['select'] += time.time() - start
+            if selected is not None:
+                start = time.time()
+                child = self.expand(*selected)
+                times['expand'] += time.time() - start
+                if child is None:
+                    continue
+
+                start = time.time()
+                won = self.game.simulate(child)
+                times['simulate'] += time.time() - start
+
+                start = time.time()
+                self.backprop(selected[0], won)
+                times['backprop'] += time.time() - start
+        print(times)
+
+    def play(self, state, playerMove=None):
+        if playerMove is not None:
+            idx = self.tree.findChild(0, playerMove)
+            if idx >= 0:
+                self.root = self.makeNode(idx, state.copy())
+            else:
+                self.root = self.nodeClass(state=state.copy())
+        if self.tree.numChildren[0] == 0:
+            self.tree.parentIsAI[0] = self.rootNode.parentIsAI
+
+        self.search()
+
+        tree = self.tree
+        start, end = tree.children(0)
+        plays = tree.plays[start:end]
+        winRatios = np.where(plays > 0, tree.wins[start:end] / np.maximum(plays, 1), -np.inf)
+        bestIdx = start + int(np.argmax(winRatios))
+        bestChild = self.makeNode(bestIdx, type(self.rootNode.state).findState(int(tree.move[bestIdx]), self.rootNode.state))
+
+        print('Best Child\'s number of plays:', bestChild.plays)
+        return bestChild, winRatios[bestIdx - start]
@@ -1,6 +1,6 @@
 # have AI play Nim via a Monte Carlo Tree Search (MCTS)
 
-from multiprocessing import Process, Queue, cpu_count
+from multiprocessing import Process, Pipe, cpu_count
 from tqdm import tqdm
 import numpy.random as npr
 import numpy as np
@@ -38,7 +38,7 @@ class Nim:
         tempState = temp.state
         ##logg('State',tempState)
         while tempState > 0:
-            move = random.sample(temp.listMoves(), 1)[0]
+            move = random.choice(tuple(temp.listMoves()))
             tempState -= move
             temp = Node(state=tempState, isAI=not temp.isAI)
             ##logg('Move:', move, tempState)
@@ -80,7 +80,7 @@ class MCTS:
     def __init__(self, game=Nim, trialsPerMove=100000):
         self.trials = trialsPerMove
         self.game = game
-        self.root = Node()
+        self.root = None
 
     def ucb(self, wins, numSim, numSimParent, c=2**0.5):
         return wins / numSim + c * (np.log(numSimParent) / numSim) ** 0.5
@@ -142,35 +142,55 @@ class MCTS:
             node.plays += 1
             node = node.parent
 
-    def play(self, state, queue=None, playerMove=None):
-        self.root = Node(state=state, children=set())
+    def advance(self, move): # keep the subtree under a move instead of rebuilding the tree next turn
+        if self.root is not None:
+            self.root = self.root.findChild(move)
+
+    def play(self, state, playerMove=None):
+        if playerMove is not None:
+            self.advance(playerMove)
+        if self.root is None or self.root.state != state:
+            self.root = Node(state=state, children=set())
+        self.root.parent = None
 
         for i in tqdm(range(self.trials)):
             bestNode = self.select()
             if type(bestNode) is Node:
                 self.expand(bestNode)
 
-        bestChild = None
-        bestWinRatio = 0
-
         ret = {}
         for child in self.root.children:
-            winRatio = child.wins / child.plays
-            ret[child.moveVal] = winRatio
+            ret[child.moveVal] = (child.wins, child.plays)
+        return ret
 
-        if queue is None:
-            return ret
-        else:
-            queue.put(ret)
-            #queue.put('a')
+def worker(conn, seed): # lives for the whole game, so its tree carries over from move to move
+    random.seed(seed)
+    ai = MCTS()
+    while True:
+        msg = conn.recv()
+        if msg[0] == 'play':
+            conn.send(ai.play(msg[1], msg[2]))
+        elif msg[0] == 'advance':
+            ai.advance(msg[1])
+        elif msg[0] == 'stop':
+            break
+    conn.close()
 
 nCores = cpu_count()
-Q = Queue()
 
 def fight():
     nim = Nim()
-    ai = MCTS()
     inp = lambda: int(input('Board State: {} | Choose number (1-3): '.format(nim.num)))
+
+    conns = []
+    procs = []
+    for core in range(nCores):
+        parentConn, childConn = Pipe()
+        p = Process(target=worker, args=(childConn, core), daemon=True)
+        p.start()
+        conns.append(parentConn)
+        procs.append(p)
+
     playerInp = inp()
     winner = nim.play(playerInp)
 
@@ -179,39 +199,42 @@ def fight():
         #aiMove, confidence = ai.play(nim.num)
 
         # multiprocessing
-        procs = []
-        for core in range(nCores):
-            p = Process(target=ai.play, args=(nim.num, Q, playerInp))
-            procs.append(p)
-            p.start()
+        for conn in conns:
+            conn.send(('play', nim.num, playerInp))
 
         summative = {}
-        for proc in procs:
-            proc.join()
-
-            ret = Q.get()
-            for key, val in ret.items():
+        for conn in conns:
+            ret = conn.recv()
+            for key, (wins, plays) in ret.items():
                 if key in summative:
-                    summative[key] += val
+                    summative[key] = (summative[key][0] + wins, summative[key][1] + plays)
                 else:
-                    summative[key] = val
+                    summative[key] = (wins, plays)
 
         bestMove = None
         bestWinRatio = 0
-        for move, winRatio in summative.items():
+        for move, (wins, plays) in summative.items():
+            winRatio = wins / plays
             if bestWinRatio < winRatio or bestMove is None:
                 bestMove = move
                 bestWinRatio = winRatio
 
         aiMove = bestMove
-        confidence = bestWinRatio / nCores 
+        confidence = bestWinRatio
 
         print('AI chooses {} | {}% confidence in AI win'.format(aiMove, round(confidence * 100, 2)))
         winner = nim.play(aiMove)
         if winner != -1:
             break
 
+        for conn in conns:
+            conn.send(('advance', aiMove))
         playerInp = inp()
         winner = nim.play(playerInp)
 
+    for conn in conns:
+        conn.send(('stop',))
+    for p in procs:
+        p.join()
+
 fight()
@@ -0,0 +1,110 @@
+# root-parallel MCTS: a pool of long-lived worker processes, each growing its own tree across moves
+
+from multiprocessing import Process, Pipe, cpu_count
+from mcts import *
+
+def poolWorker(conn, engine, game, nodeClass, trialsPerMove, seed):
+    random.seed(seed) # forked workers inherit the parent's RNG state, so without this they'd all grow the same tree
+    npr.seed(seed)
+    ai = engine(game, nodeClass, trialsPerMove=trialsPerMove)
+
+    while True:
+        msg = conn.recv()
+        if msg[0] == 'root':
+            _, state, parentIsAI = msg
+            ai.root.state = state
+            ai.root.parentIsAI = parentIsAI
+        elif msg[0] == 'play':
+            _, state, playerMove = msg
+            ai.play(state, playerMove)
+            conn.send((ai.childStats(), ai.root.parentIsAI))
+        elif msg[0] == 'advance':
+            ai.advance(msg[1])
+        elif msg[0] == 'trials':
+            ai.trials = msg[1]
+        elif msg[0] == 'stop':
+            break
+    conn.close()
+
+class MCTSPool: # drop-in for MCTS, e.g. ttt.fightAI(TTTNode, engine=MCTSPool)
+    def __init__(self, game, nodeClass, trialsPerMove=1000, numWorkers=None, engine=None):
+        if numWorkers is None:
+            numWorkers = cpu_count()
+        if engine is None:
+            engine = MCTS
+
+        self.game = game
+        self.nodeClass = nodeClass
+        self.trialsPerMove = trialsPerMove
+        self.rootNode = nodeClass()
+        self.started = False
+
+        self.conns = []
+        self.procs = []
+        for seed in range(numWorkers):
+            parentConn, childConn = Pipe()
+            p = Process(target=poolWorker, args=(childConn, engine, game, nodeClass, trialsPerMove, seed), daemon=True)
+            p.start()
+            childConn.close()
+            self.conns.append(parentConn)
+            self.procs.append(p)
+
+    @property
+    def trials(self):
+        return self.trialsPerMove
+
+    @trials.setter
+    def trials(self, trialsPerMove):
+        self.trialsPerMove = trialsPerMove
+        self.broadcast(('trials', trialsPerMove))
+
+    @property
+    def root(self):
+        return self.rootNode
+
+    @root.setter
+    def root(self, node): # game code moves the root to the AI's chosen node, so every worker re-roots its own tree there
+        self.rootNode = node
+        if self.started:
+            self.broadcast(('advance', node.parentMoveVal))
+
+    def broadcast(self, msg):
+        for conn in self.conns:
+            conn.send(msg)
+
+    def play(self, state, playerMove=None):
+        if not self.started: # pass on anything the game set on the root before the first search
+            self.broadcast(('root', self.rootNode.state, self.rootNode.parentIsAI))
+            self.started = True
+        self.broadcast(('play', state, playerMove))
+
+        merged = {}
+        for conn in self.conns:
+            stats, rootParentIsAI = conn.recv()
+            for move, (wins, plays) in stats.items():
+                totalWins, totalPlays = merged.get(move, (0, 0))
+                merged[move] = (totalWins + wins, totalPlays + plays)
+
+        bestMove = None
+        bestWinRatio = 0
+        for move, (wins, plays) in merged.items():
+            winRatio = wins / plays # weighted by visits: a move only a few workers tried barely counts
+            if bestMove is None or winRatio > bestWinRatio:
+                bestMove = move
+                bestWinRatio = winRatio
+
+        wins, plays = merged[bestMove]
+        bestChild = self.nodeClass(bestMove, state=type(state).findState(bestMove, state), parentIsAI=(not rootParentIsAI))
+        bestChild.wins = wins
+        bestChild.plays = plays
+
+        print('Best Child\'s number of plays:', bestChild.plays)
+        return bestChild, bestWinRatio
+
+    def close(self):
+        self.broadcast(('stop',))
+        for p in self.procs:
+            p.join()
+
+    def __getstate__(self): # worker processes can't be pickled
+        raise TypeError('MCTSPool can\'t be saved, save one of its engines instead')
@@ -0,0 +1,168 @@
+# multi-process pretraining: N processes grow one array-backed tree whose fields live in shared memory
+
+from multiprocessing import Process, Lock, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+from mctsArray import *
+
+class SharedArrayTree(ArrayTree): # fixed-capacity arena, nodes are handed out under one lock and never moved
+    def __init__(self, capacity, names=None, allocLock=None):
+        self.blocks = []
+        self.owner = names is None
+        for i, (name, dtype, fill) in enumerate(ArrayTree.fields + (('counter', np.int64, 0),)):
+            length = 1 if name == 'counter' else capacity
+            if self.owner:
+                block = SharedMemory(create=True, size=length * np.dtype(dtype).itemsize)
+            else:
+                block = SharedMemory(name=names[i])
+            arr = np.ndarray(length, dtype=dtype, buffer=block.buf)
+            if self.owner:
+                arr[:] = fill
+            setattr(self, name, arr)
+            self.blocks.append(block)
+        self.names = [block.name for block in self.blocks]
+        self.allocLock = allocLock
+
+    @property
+    def size(self): # kept in shared memory, so every process sees the others' allocations
+        return int(self.counter[0])
+
+    @size.setter
+    def size(self, size):
+        self.counter[0] = size
+
+    @classmethod
+    def fromTree(cls, tree, capacity, allocLock):
+        ret = cls(max(capacity, tree.size), allocLock=allocLock)
+        for name, dtype, fill in ArrayTree.fields:
+            getattr(ret, name)[:tree.size] = getattr(tree, name)[:tree.size]
+        ret.size = tree.size
+        return ret
+
+    def toTree(self): # a plain ArrayTree copy, the normal save path can pickle that
+        ret = ArrayTree(max(self.size, 1024))
+        for name, dtype, fill in ArrayTree.fields:
+            getattr(ret, name)[:self.size] = getattr(self, name)[:self.size]
+        ret.size = self.size
+        return ret
+
+    def alloc(self, n):
+        with self.allocLock:
+            start = self.size
+            if start + n > self.capacity():
+                raise MemoryError('shared tree arena is full')
+            self.size = start + n
+        return start
+
+    def addChildren(self, idx, moves): # numChildren goes in before firstChild, so a reader that sees firstChild also sees every child
+        n = len(moves)
+        start = self.alloc(n)
+        end = start + n
+        self.move[start:end] = moves
+        self.parent[start:end] = idx
+        self.parentIsAI[start:end] = not self.parentIsAI[idx]
+        self.numChildren[idx] = n
+        self.firstChild[idx] = start
+        return start
+
+    def close(self):
+        for name, dtype, fill in ArrayTree.fields + (('counter', np.int64, 0),):
+            setattr(self, name, None) # a block can't be closed while arrays still point into it
+        for block in self.blocks:
+            block.close()
+            if self.owner:
+                block.unlink()
+
+def sharedWorker(names, capacity, allocLock, locks, game, nodeClass, rootState, rootParentIsAI, c, trials, seed):
+    random.seed(seed)
+    npr.seed(seed)
+    ai = SharedArrayMCTS(game, nodeClass, c=c, numProcs=1)
+    ai.tree = SharedArrayTree(capacity, names, allocLock)
+    ai.locks = locks
+    ai.rootNode = nodeClass(state=rootState, parentIsAI=rootParentIsAI)
+    ai.rootNode.treeIdx = 0
+
+    for i in range(trials):
+        selected = ai.select()
+        if selected is not None:
+            child = ai.expand(*selected)
+            if child is not None:
+                ai.backprop(selected[0], game.simulate(child))
+    ai.tree.close()
+
+class SharedArrayMCTS(ArrayMCTS): # drop-in for MCTS, e.g. ttt.saveAI(TTTNode, 'ttt.pkl', trialsPretrain=int(1e6), engine=SharedArrayMCTS)
+    arenaNodes = 2**20 # default cap on the nodes one search can add, about 50MB of fields
+    def __init__(self, game, nodeClass, trialsPerMove=1000, c=2**0.5, numProcs=None, capacity=None):
+        super().__init__(game, nodeClass, trialsPerMove, c)
+        if numProcs is None:
+            numProcs = cpu_count()
+        self.numProcs = numProcs
+        self.capacity = capacity # nodes in the shared arena, by default room for every trial to expand a node up to arenaNodes more
+        self.locks = None # striped expansion locks, only set inside a search
+
+    def __getstate__(self):
+        ret = dict(self.__dict__)
+        ret['locks'] = None
+        return ret
+
+    def expand(self, path, state): # wins and plays are updated without locks, only growing the tree is locked
+        tree = self.tree
+        idx = path[-1]
+        ended = None
+        with self.locks[idx % len(self.locks)]:
+            if tree.numChildren[idx] == 0:
+                moves = tuple(self.makeNode(idx, state).listMoves())
+                if len(moves) == 0:
+                    ended = state.isTerminal()
+                else:
+                    try:
+                        tree.addChildren(idx, moves)
+                    except MemoryError: # out of arena, roll out from the node itself
+                        return self.makeNode(idx, state)
+        if tree.numChildren[idx] == 0:
+            self.backprop(path, ended)
+            return None
+
+        start, end = tree.children(idx)
+        untried = np.nonzero(tree.plays[start:end] == 0)[0]
+        if len(untried) == 0: # other processes played every child since this one selected idx
+            child = start + random.randrange(end - start)
+        else:
+            child = start + int(untried[random.randrange(len(untried))])
+        path.append(child)
+        state.update(int(tree.move[child]))
+        return self.makeNode(child, state)
+
+    def search(self):
+        if self.numProcs <= 1: # nothing to share, the plain array search is enough
+            self.locks = [Lock()]
+            try:
+                return super().search()
+            finally:
+                self.locks = None
+
+        start = time.time()
+        branching = max(len(self.rootNode.listMoves()), 1)
+        capacity = self.capacity
+        if capacity is None:
+            capacity = self.tree.size + min(self.trials * branching, self.arenaNodes) + 1
+        allocLock = Lock()
+        locks = [Lock() for _ in range(64)]
+        shared = SharedArrayTree.fromTree(self.tree, capacity, allocLock)
+        try:
+            procs = []
+            for i in range(self.numProcs):
+                trials = self.trials // self.numProcs + (i < self.trials % self.numProcs)
+                args = (shared.names, shared.capacity(), allocLock, locks, self.game, self.nodeClass, self.rootNode.state, self.rootNode.parentIsAI, self.c, trials, random.randrange(2**32))
+                p = Process(target=sharedWorker, args=args, daemon=True)
+                p.start()
+                procs.append(p)
+            for p in procs:
+                p.join()
+            self.tree = shared.toTree()
+        finally:
+            shared.close()
+
+        elapsed = time.time() - start
+        print('{} processes | {} playouts/sec | {} nodes'.format(self.numProcs, round(self.trials / elapsed), self.tree.size))
+        if self.tree.size + branching > capacity: # expand may have fallen back on rolling out from leaves
+            print('Shared tree arena filled up at {} nodes, pass a larger capacity to keep growing the tree'.format(capacity))
@@ -0,0 +1,191 @@
+# transposition-aware MCTS: positions reached by different move orders share one node, turning the tree into a DAG
+
+from collections import OrderedDict
+from mcts import *
+
+class TranspositionMCTS(MCTS): # drop-in for MCTS, e.g. ttt.fightAI(TTTNode, engine=TranspositionMCTS)
+    checkpoints = False # checkpoints file each node under its one parent
+
+    def __init__(self, game, nodeClass, trialsPerMove=1000, tableSize=int(1e5), **kwargs):
+        assert kwargs.get('maxNodes') is None and kwargs.get('maxBytes') is None # a shared node has several parents, so there's no one subtree to evict it from
+        assert kwargs.get('numThreads', 1) == 1 # the tree-parallel search doesn't know about shared nodes
+        assert not kwargs.get('solver', False) and kwargs.get('raveK') is None # the path-based select and backprop keep neither proofs nor AMAF totals
+        assert not kwargs.get('halving', False) # sequential halving expands and selects from single nodes, not paths
+        super().__init__(game, nodeClass, trialsPerMove, **kwargs)
+        self.tableSize = tableSize
+        self.table = OrderedDict() # key -> node, least recently used first
+        self.numNodes = 0
+        self.hits = 0
+        self.initNode(self.root)
+
+    def initNode(self, node): # a shared node can't tell its stats apart per parent, so visits are also kept per edge
+        node.edges = {}
+        node.edgePlays = {}
+        self.numNodes += 1
+
+    def key(self, state, parentIsAI):
+        return state.key(), parentIsAI
+
+    def lookup(self, key):
+        node = self.table.get(key)
+        if node is not None:
+            self.table.move_to_end(key)
+            self.hits += 1
+        return node
+
+    def store(self, key, node):
+        self.table[key] = node
+        if len(self.table) > self.tableSize:
+            self.table.popitem(last=False) # an evicted node stays reachable through its edges, it just stops being shared
+
+    def iterNodes(self): # every node reachable from the root once, though several parents may share it
+        seen = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            yield node
+            stack.extend(node.edges.values())
+
+    def isLeaf(self, node):
+        return node.isLeaf()
+
+    def select(self):
+        node = self.root
+        path = [node]
+        moves = []
+        while not self.isLeaf(node):
+            logPlays = np.log(node.plays)
+            bestMove = None
+            bestUCB = 0
+            for move, child in node.edges.items():
+                ucbVal = child.wins / child.plays + (2 * logPlays / node.edgePlays[move]) ** 0.5
+                if ucbVal > bestUCB or bestMove is None:
+                    bestMove = move
+                    bestUCB = ucbVal
+            if bestMove is None:
+                self.backprop(path, moves, node.isTerminal())
+                return None
+
+            node = node.edges[bestMove]
+            path.append(node)
+            moves.append(bestMove)
+            ended = node.state.isTerminal()
+            if ended is not None:
+                self.backprop(path, moves, ended)
+                return None
+        return path, moves
+
+    def expand(self, path, moves):
+        node = path[-1]
+        newMove = node.untriedMoves().pop()
+
+        stateClass = type(self.root.state)
+        state = stateClass.findState(newMove, node.state)
+        key = self.key(state, not node.parentIsAI)
+        child = self.lookup(key)
+        if child is None:
+            child = self.nodeClass(newMove, state=state, parent=node, parentIsAI=(not node.parentIsAI))
+            self.initNode(child)
+            self.store(key, child)
+
+        node.edges[newMove] = child
+        node.edgePlays[newMove] = 0
+        node.children[newMove] = child # a shared child's own parentMoveVal can belong to another parent, so key by this edge's move
+        path.append(child)
+        moves.append(newMove)
+        return child
+
+    def backprop(self, path, moves, won): # walks the path taken, since a shared node has more than one parent
+        if np.ndim(won) > 0:
+            outcomes, counts = np.unique(np.asarray(won), return_counts=True)
+        else:
+            outcomes, counts = (won,), (1,)
+        plays = int(np.sum(counts))
+
+        for idx, node in enumerate(path):
+            for outcome, count in zip(outcomes, counts):
+                node.wins += self.game.calcReward(node, outcome) * int(count)
+            node.plays += plays
+            if idx < len(moves):
+                node.edgePlays[moves[idx]] += plays
+
+    def searchSerial(self, searchStart, timeBudget):
+        times = {'select': 0, 'expand': 0, 'simulate': 0, 'backprop': 0}
+        for i in tqdm(range(self.trials)):
+            if i & 63 == 0 and i > 0:
+                if self.searchDone(searchStart, timeBudget):
+                    break
+                self.report(searchStart)
+            start = time.time()
+            selected = self.select()
+            times['select'] += time.time() - start
+            if selected is not None:
+                start = time.time()
+                child = self.expand(*selected)
+                times['expand'] += time.time() - start
+
+                start = time.time()
+                won, _ = self.rollout(child) # the AMAF moves are ignored, RAVE is only kept on tree nodes
+                times['simulate'] += time.time() - start
+
+                start = time.time()
+                self.backprop(*selected, won)
+                times['backprop'] += time.time() - start
+            self.trialsDone += 1
+        print(times)
+        self.numNodes = self.countNodes() # a table hit can link in a node created under an earlier root
+        print('Nodes: {} | transpositions: {}'.format(self.numNodes, self.hits))
+
+    def ponder(self): # MCTS.ponder with this engine's path-based select, expand and backprop
+        i = 0
+        while not self.ponderStop:
+            selected = self.select()
+            if selected is not None:
+                child = self.expand(*selected)
+                won, _ = self.rollout(child)
+                self.backprop(*selected, won)
+            i += 1
+        self.ponderTrials = i
+        print('Pondered {} trials'.format(i))
+
+    def childStats(self):
+        ret = {}
+        for move, child in self.root.edges.items():
+            ret[move] = (child.wins, child.plays)
+        return ret
+
+    def advance(self, move):
+        child = self.root.edges.get(move)
+        if child is None:
+            stateClass = type(self.root.state)
+            child = self.nodeClass(move, state=stateClass.findState(move, self.root.state), parentIsAI=(not self.root.parentIsAI))
+            self.initNode(child)
+        child.parentMoveVal = move
+        self.root = child
+        self.numNodes = self.countNodes()
+
+    def play(self, state, playerMove=None, timeBudget=None, callback=None, interval=None):
+        if playerMove is not None:
+            self.root = self.root.edges.get(playerMove)
+        if self.root is None:
+            self.root = self.nodeClass(state=state)
+        if not hasattr(self.root, 'edges'): # a root set from outside the engine
+            self.initNode(self.root)
+        self.numNodes = self.countNodes() # nodes left behind above the new root no longer count
+
+        trials = self.trials
+        self.trials = max(trials - self.ponderCredit(playerMove), 0)
+        try:
+            self.search(timeBudget, callback, interval)
+        finally:
+            self.trials = trials
+
+        bestMove, bestChild = self.pickMove(dict(self.root.edges))
+        bestWinRatio = bestChild.wins / bestChild.plays
+        bestChild.parentMoveVal = bestMove # a shared node keeps the move it was first created by, which may be another parent's
+
+        print('Best Child\'s number of plays:', bestChild.plays)
+        return bestChild, bestWinRatio
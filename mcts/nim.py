@@ -65,5 +65,6 @@ class Nim(Game):
         if (won and not node.parentIsAI) or (not won and node.parentIsAI):
             return loseReward
 
-nim = Nim()
-nim.fightAI(NimNode)
+if __name__ == '__main__':
+    nim = Nim()
+    nim.fightAI(NimNode)
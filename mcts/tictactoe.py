@@ -5,6 +5,9 @@ import numpy as np
 import random
 
 length = 3
+lines = np.array([[y * length + x for x in range(length)] for y in range(length)] + # rows, columns and both diagonals as flat board indices
+    [[y * length + x for y in range(length)] for x in range(length)] +
+    [[i * length + i for i in range(length)], [(length - i - 1) * length + i for i in range(length)]])
 
 class TTTState(State):
     def __init__(self, state=None):
@@ -56,6 +59,9 @@ class TTTState(State):
         ret.x = self.x
         return ret
 
+    def key(self):
+        return self.state.tobytes()
+
 class TTTNode(Node):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -92,9 +98,31 @@ class TTT(Game):
 
     def calcReward(node, outcome): # function favoring AI - if AI wins return some positive number
         if node.parentIsAI: # if a player node finds out its state is terminal before making a move, its parent (an AI node) made a winning move
-            return outcome
+            return int(outcome) # outcome is an np.int8 off the board, which would overflow once summed into wins
         else:
-            return -outcome
+            return -int(outcome)
+
+    def simulateBatch(node, k): # k random playouts at once on a (k, length**2) stack of boards
+        ended = node.isTerminal()
+        if ended is not None:
+            return np.full(k, ended, dtype=np.int8)
+
+        boards = np.tile(node.state.state.reshape(-1), (k, 1))
+        outcomes = np.zeros(k, dtype=np.int8)
+        running = np.arange(k)
+        piece = -1 if node.state.x else 1
+        while len(running) > 0:
+            empty = boards[running] == 0
+            cells = np.argmax(np.where(empty, npr.random(empty.shape), -1), axis=1)
+            boards[running, cells] = piece
+
+            lineSums = boards[running][:, lines].sum(axis=2)
+            won = np.any(lineSums == piece * length, axis=1)
+            outcomes[running[won]] = piece
+            full = ~np.any(boards[running] == 0, axis=1)
+            running = running[~(won | full)]
+            piece = -piece
+        return outcomes
 
     def printState(self):
         self.printTemp()
@@ -127,9 +155,10 @@ class TTT(Game):
                 print('___')
         print('------------------------------------')
 
-trialsPretrain = int(1e6)
-ttt = TTT()
-#ttt.saveAI(TTTNode, 'ttt.pkl', 'ttt.pkl', trialsPretrain=trialsPretrain)
-#ttt.saveAI(TTTNode, 'ttt.pkl', trialsPretrain=trialsPretrain)
-ttt.fightAI(TTTNode)
-#ttt.fightAI(TTTNode, 'ttt.pkl')
+if __name__ == '__main__':
+    trialsPretrain = int(1e6)
+    ttt = TTT()
+    #ttt.saveAI(TTTNode, 'ttt.pkl', 'ttt.pkl', trialsPretrain=trialsPretrain)
+    #ttt.saveAI(TTTNode, 'ttt.pkl', trialsPretrain=trialsPretrain)
+    ttt.fightAI(TTTNode)
+    #ttt.fightAI(TTTNode, 'ttt.pkl')
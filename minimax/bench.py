@@ -0,0 +1,198 @@
+# benchmarks for the Minimax engine, run as e.g. python bench.py inplace
+
+from contextlib import redirect_stdout
+from minimaxSMP import SMPMinimax, cpu_count
+import othello as oth
+from minimax import *
+import io, random, sys, tracemalloc
+
+def quiet(): # the engine prints its node counts and table hit rates on every search
+    return redirect_stdout(io.StringIO())
+
+def othPositions(num=10, plies=(5, 9, 13), seed=0): # random midgame positions with white (the AI) to move
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < num:
+        state = oth.OthState()
+        for ply in range(rng.choice(plies)):
+            state.update(rng.choice(sorted(state.listMoves())))
+        if state.parentIsAI and state.isTerminal(0, 1) is None:
+            positions.append(state)
+    return positions
+
+def searchPosition(state, depth, **kwargs): # one fixed-depth search from state, returning the chosen move, its value and the engine's budget report
+    ai = Minimax(oth.Othello, oth.OthNode, state.copy(), depth=depth, iterative=False, **kwargs)
+    with quiet():
+        ai.search()
+    return ai.root.bestChild.parentMoveVal, ai.root.bestChild.reward, ai.budgetUsed
+
+def benchInPlace(depths=(3, 4, 5)): # nodes/sec of the node-per-position search against make/unmake on one state
+    positions = othPositions()
+    for depth in depths:
+        for inPlace in (False, True):
+            nodes = 0
+            seconds = 0
+            results = []
+            for state in positions:
+                move, value, used = searchPosition(state, depth, inPlace=inPlace)
+                nodes += used['nodes']
+                seconds += used['seconds']
+                results.append((move, value))
+            if inPlace:
+                agree = sum(a == b for a, b in zip(results, treeResults))
+                print('depth {} | inPlace=True: {} nodes/sec, {}/{} moves and values as with nodes'.format(depth, round(nodes / seconds), agree, len(positions)))
+            else:
+                treeResults = results
+                print('depth {} | inPlace=False: {} nodes/sec'.format(depth, round(nodes / seconds)))
+
+def benchTreeFree(depths=(3, 4, 5)): # peak memory and time per move, collection pause included, of the node tree against the tree-free search
+    positions = othPositions()
+    for depth in depths:
+        for keepTree in (True, False):
+            peak = 0
+            seconds = 0
+            results = []
+            for state in positions:
+                ai = Minimax(oth.Othello, oth.OthNode, state.copy(), depth=depth, keepTree=keepTree)
+                tracemalloc.start()
+                start = time.time()
+                with quiet():
+                    ai.search()
+                gc.collect() # what play() does before every tree search
+                seconds += time.time() - start
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                if keepTree:
+                    results.append((ai.root.bestChild.parentMoveVal, ai.root.bestChild.reward))
+                else:
+                    results.append((ai.rootMove, ai.rootValue))
+            line = 'depth {} | keepTree={}: {} KiB peak, {}s per move'.format(depth, keepTree, round(peak / 1024), round(seconds / len(positions), 3))
+            if keepTree:
+                treeResults = results
+            else:
+                sameMoves = sum(a[0] == b[0] for a, b in zip(results, treeResults))
+                sameValues = sum(a[1] == b[1] for a, b in zip(results, treeResults))
+                line += ', same move in {}/{} and same value in {}/{} positions as with the tree'.format(sameMoves, len(positions), sameValues, len(positions))
+            print(line)
+
+def benchPVS(depths=(4, 5, 6), aspiration=1): # nodes searched by plain alpha-beta, negamax with PVS, and PVS with an aspiration window at the root
+    positions = othPositions()
+    configs = (('alpha-beta', {}), ('pvs', {'pvs': True}), ('pvs+aspiration', {'pvs': True, 'aspiration': aspiration}))
+    for depth in depths:
+        for name, kwargs in configs:
+            nodes = 0
+            researches = 0
+            misses = 0
+            values = []
+            for state in positions:
+                ai = Minimax(oth.Othello, oth.OthNode, state.copy(), depth=depth, keepTree=False, **kwargs)
+                with quiet():
+                    ai.search()
+                nodes += ai.nodes
+                researches += ai.budgetUsed.get('researches', 0)
+                misses += ai.budgetUsed.get('aspirationFails', 0)
+                values.append(ai.rootValue)
+            line = 'depth {} | {}: {} nodes'.format(depth, name, nodes)
+            if kwargs:
+                line += ', {} re-searches, {} aspiration misses, same value in {}/{} positions'.format(researches, misses, sum(a == b for a, b in zip(values, baseValues)), len(positions))
+            else:
+                baseValues = values
+            print(line)
+
+def benchSMP(workerCounts=(1, 2, 4), timeBudget=2, num=5): # depth Lazy SMP finishes within a time budget, by number of worker processes
+    positions = othPositions(num)
+    print('{} cores'.format(cpu_count()))
+    for numWorkers in workerCounts:
+        depths = 0
+        nodes = 0
+        seconds = 0
+        for state in positions:
+            ai = SMPMinimax(oth.Othello, oth.OthNode, state.copy(), depth=64, timeBudget=timeBudget, numWorkers=numWorkers)
+            with quiet():
+                ai.search()
+            depths += ai.depthDone
+            nodes += ai.nodes
+            seconds += ai.budgetUsed['seconds']
+        print('{} workers: depth {} in {}s, {} nodes/sec'.format(numWorkers, round(depths / num, 1), timeBudget, round(nodes / seconds)))
+
+def benchOrdering(depths=(4, 5, 6), killers=2): # nodes and cutoff rates with killer moves and the history heuristic ordering children
+    positions = othPositions()
+    configs = (('table move only', {}), ('killers', {'killers': killers}), ('history', {'history': True}), ('killers+history', {'killers': killers, 'history': True}))
+    for depth in depths:
+        for name, kwargs in configs:
+            nodes = 0
+            cutoffs = 0
+            firstCutoffs = 0
+            interiorNodes = 0
+            values = []
+            for state in positions:
+                ai = Minimax(oth.Othello, oth.OthNode, state.copy(), depth=depth, keepTree=False, **kwargs)
+                with quiet():
+                    ai.search()
+                nodes += ai.nodes
+                cutoffs += ai.cutoffs
+                firstCutoffs += ai.firstCutoffs
+                interiorNodes += ai.interiorNodes
+                values.append(ai.rootValue)
+            line = 'depth {} | {}: {} nodes, cutoffs at {}% of interior nodes, {}% on the first move'.format(depth, name, nodes,
+                round(cutoffs / interiorNodes * 100, 1), round(firstCutoffs / cutoffs * 100, 1))
+            if kwargs:
+                line += ', same value in {}/{} positions'.format(sum(a == b for a, b in zip(values, baseValues)), len(positions))
+            else:
+                baseValues = values
+            print(line)
+
+def benchEval(calls=2000): # leaf evaluation with and without the position's move lists already cached
+    positions = othPositions()
+    bitPositions = [oth.BitOthState(state.state.copy(), state.parentIsAI) for state in positions]
+    for name, states in (('OthState', positions), ('BitOthState', bitPositions)):
+        for cached in (False, True):
+            start = time.time()
+            for i in range(calls):
+                state = states[i % len(states)]
+                if not cached and hasattr(state, 'moveCache'):
+                    state.moveCache = {}
+                state.evalPieces(True)
+            print('{} | cached={}: {}us per evaluation'.format(name, cached, round((time.time() - start) / calls * 1e6, 1)))
+
+def benchBitboard(calls=2000, depth=4): # move generation speed of OthState against BitOthState, and the search on top of each
+    positions = othPositions()
+    bitPositions = [oth.BitOthState(state.state.copy(), state.parentIsAI) for state in positions]
+    for name, states in (('OthState', positions), ('BitOthState', bitPositions)):
+        start = time.time()
+        for i in range(calls): # genMoves, since OthState.listMoves is cached
+            state = states[i % len(states)]
+            state.genMoves(state.parentIsAI)
+        genRate = calls / (time.time() - start)
+
+        nodes = 0
+        seconds = 0
+        values = []
+        for state in states:
+            ai = Minimax(oth.Othello, oth.OthNode, state.copy(), depth=depth, keepTree=False)
+            with quiet():
+                ai.search()
+            nodes += ai.nodes
+            seconds += ai.budgetUsed['seconds']
+            values.append((ai.rootMove, ai.rootValue))
+        line = '{}: {} move generations/sec, depth {} search at {} nodes/sec'.format(name, round(genRate), depth, round(nodes / seconds))
+        if states is positions:
+            baseValues = values
+        else:
+            line += ', same move and value in {}/{} positions'.format(sum(a == b for a, b in zip(values, baseValues)), len(states))
+        print(line)
+
+benchmarks = {
+    'inplace': benchInPlace,
+    'treefree': benchTreeFree,
+    'pvs': benchPVS,
+    'smp': benchSMP,
+    'ordering': benchOrdering,
+    'bitboard': benchBitboard,
+    'eval': benchEval,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        print('#', name)
+        benchmarks[name]()
@@ -3,11 +3,64 @@
 from tqdm import tqdm
 import pickle as pkl
 import numpy as np
-import random, time, pdb, gc
+import random, time, threading, queue, pdb, gc
 
 def logg(*args):
     print(*args)
 
+class SearchTimeout(Exception): # raised inside a search when its time or node budget runs out
+    pass
+
+def zobristKeys(numPieces, numSquares, seed=0): # random 64-bit keys, one per piece per square, plus one for the side to move
+    rng = random.Random(seed)
+    return [[rng.getrandbits(64) for _ in range(numSquares)] for _ in range(numPieces)], rng.getrandbits(64)
+
+exact, lowerBound, upperBound = 0, 1, 2 # what a transposition table value says about the true one
+noMove = -2 # -1 is a pass in othello
+nullWindow = 1e-9 # narrower than the gap between any two evaluations
+
+class TranspositionTable: # fixed-size, indexed by the low bits of a position's Zobrist key
+    fields = (('keys', np.uint64, 0), ('depths', np.int16, -1), ('flags', np.int8, 0), ('values', np.float64, 0),
+        ('moves', np.int16, noMove), ('ages', np.int16, 0)) # depths holds the depth searched below the position, -1 for an empty slot
+
+    def __init__(self, size=2**16):
+        assert size & (size - 1) == 0 # a power of two, so the index is a mask
+        self.size = size
+        for name, dtype, fill in TranspositionTable.fields:
+            setattr(self, name, np.full(size, fill, dtype=dtype))
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def newSearch(self):
+        self.age = (self.age + 1) % 2**15
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key): # (depth, flag, value, move) stored for the position, or None
+        self.probes += 1
+        idx = key & (self.size - 1)
+        if self.depths[idx] < 0 or int(self.keys[idx]) != key:
+            return None
+        self.hits += 1
+        move = int(self.moves[idx])
+        return int(self.depths[idx]), int(self.flags[idx]), float(self.values[idx]), None if move == noMove else move
+
+    def store(self, key, depth, flag, value, move):
+        idx = key & (self.size - 1)
+        # depth-preferred: a deeper result stays unless it is left over from an earlier search
+        if self.depths[idx] >= 0 and int(self.keys[idx]) != key and self.ages[idx] == self.age and self.depths[idx] > depth:
+            return
+        self.keys[idx] = key
+        self.depths[idx] = depth
+        self.flags[idx] = flag
+        self.values[idx] = value
+        self.moves[idx] = noMove if move is None else move
+        self.ages[idx] = self.age
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes > 0 else 0
+
 class State:
     def __init__(self, state=None, parentIsAI=False):
         self.state = state
@@ -19,6 +72,18 @@ class State:
     def isTerminal(self, depth, maxDepth):
         pass
 
+    def key(self): # Zobrist key of the position including the side to move, None if the game doesn't hash its states
+        return None
+
+    def listMoves(self): # the in-place search asks the state, not a node
+        pass
+
+    def makeMove(self, move): # update in place, returning whatever undoMove needs to take the move back
+        pass
+
+    def undoMove(self, move, record):
+        pass
+
     def copy(self):
         myClass = type(self)
         return myClass(state=self.state)
@@ -36,7 +101,7 @@ class Node:
         self.parentIsAI = parentIsAI
         self.reward = 0
         self.bestChild = None
-        self.children = set()
+        self.children = {} # move -> child
 
     def genChildren(self):
         for move in self.listMoves():
@@ -45,7 +110,7 @@ class Node:
                 state=self.state.findState(move),
                 parent=self,
                 parentIsAI = not self.parentIsAI)
-            self.children.add(child)
+            self.children[move] = child
 
     def listMoves(self): # method implementation varies from game to game
         pass
@@ -54,9 +119,7 @@ class Node:
         return self.state.isTerminal(depth, maxDepth)
 
     def findChild(self, val):
-        for child in self.children:
-            if child.parentMoveVal == val:
-                return child
+        return self.children.get(val)
 
 class Game:
     def __init__(self, state=None):
@@ -69,7 +132,10 @@ class Game:
     def printState(self):
         print(self.state.state)
 
-    def fightAI(self, nodeClass, loadFile=None):
+    def fightAI(self, nodeClass, loadFile=None, engine=None, ponder=False):
+        if engine is None:
+            engine = Minimax
+
         def inp():
             self.printState()
             return int(input('Enter move: '))
@@ -77,7 +143,7 @@ class Game:
         playerInp = inp()
 
         if loadFile is None:
-            ai = Minimax(type(self), nodeClass, self.state)
+            ai = engine(type(self), nodeClass, self.state)
         else:
             if not loadFile.endswith('.pkl'):
                 loadFile += '.pkl'
@@ -100,43 +166,407 @@ class Game:
 
             ai.root = aiMoveNode
             logg('Available moves:', ai.root.listMoves())
-            playerInp = inp()
+            if ponder: # search the player's likely replies while they think
+                ai.startPonder()
+                playerInp = inp()
+                ai.stopPonder()
+            else:
+                playerInp = inp()
             winner = self.play(playerInp)
 
 class Minimax:
-    def __init__(self, game, nodeClass, initialState, depth=4):
-        self.depth = depth
+    def __init__(self, game, nodeClass, initialState, depth=4, timeBudget=None, nodeBudget=None, tableSize=2**16, iterative=True, inPlace=False, keepTree=True, pvs=False, aspiration=None, killers=0, history=False):
+        self.depth = depth # the deepest iteration; with a time budget the search stops at the last depth it finished
+        self.searchDepth = depth # depth of the iteration running now
+        self.iterative = iterative
+        self.inPlace = inPlace # below the root, search one state with makeMove/undoMove instead of building a node per position
+        self.pvs = pvs # state searches use negamax with principal variation search
+        self.aspiration = aspiration # half-width of the window around the last iteration's root value, None for a full window
+        assert not pvs or inPlace or not keepTree # only states are searched by negamax
+        assert aspiration is None or not keepTree
+        self.researches = 0
+        self.aspirationFails = 0
+        self.killers = killers # killer moves kept per ply, 0 for none
+        self.history = history # order moves by how often they caused cutoffs anywhere in the tree
+        self.killerMoves = {} # ply -> moves that last caused a cutoff there, most recent first; both tables last the whole game
+        self.historyTable = {} # move -> cutoff score
+        self.cutoffs = 0
+        self.firstCutoffs = 0
+        self.interiorNodes = 0
+        self.depthDone = 0
         self.game = game
         self.nodeClass = nodeClass
+        self.keepTree = keepTree # False searches states only, keeping no nodes beyond the root and the move it returns
         self.root = nodeClass(state=initialState)
-        self.root.genChildren()
+        if keepTree:
+            self.root.genChildren()
+        self.timeBudget = timeBudget # seconds per move
+        self.nodeBudget = nodeBudget # nodes visited per move
+        self.nodes = 0
+        self.nodeLimit = None
+        self.deadline = None
+        self.budgetUsed = None
+        self.ponderThread = None
+        self.ponderStop = False
+        self.callback = None # called with progress reports during a search, returning True stops it
+        self.interval = 0.5 # seconds between progress reports
+        self.nextReport = 0
+        self.searchStart = None
+        self.stopSearch = False
+        self.table = None if tableSize is None else TranspositionTable(tableSize)
+        self.rootMove = None # best root move and value of a tree-free search, with its principal variation
+        self.rootValue = None
+        self.pv = []
+
+    def __getstate__(self): # a running ponder thread can't be pickled
+        ret = dict(self.__dict__)
+        ret['ponderThread'] = None
+        ret['callback'] = None
+        return ret
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        for name, default in (('timeBudget', None), ('nodeBudget', None), ('nodes', 0), ('nodeLimit', None), ('deadline', None), ('budgetUsed', None),
+                ('ponderThread', None), ('ponderStop', False), ('callback', None), ('interval', 0.5), ('nextReport', 0), ('searchStart', None), ('stopSearch', False), ('table', None),
+                ('searchDepth', d['depth']), ('iterative', False), ('depthDone', 0), ('inPlace', False),
+                ('keepTree', True), ('rootMove', None), ('rootValue', None), ('pv', []),
+                ('pvs', False), ('aspiration', None), ('researches', 0), ('aspirationFails', 0),
+                ('killers', 0), ('history', False), ('killerMoves', {}), ('historyTable', {}), ('cutoffs', 0), ('firstCutoffs', 0), ('interiorNodes', 0)):
+            self.__dict__.setdefault(name, default)
+
+    def checkBudget(self):
+        self.nodes += 1
+        if self.ponderStop or self.stopSearch:
+            raise SearchTimeout
+        if self.nodeLimit is not None and self.nodes > self.nodeLimit:
+            raise SearchTimeout
+        if self.nodes & 63 == 0: # checked every 64 nodes to keep the search cheap
+            if self.deadline is not None and time.time() > self.deadline:
+                raise SearchTimeout
+            if self.callback is not None:
+                self.report()
+
+    def progress(self): # the search so far: best fully searched root move, its value, principal variation and speed
+        elapsed = time.time() - self.searchStart
+        if not self.keepTree:
+            return {'move': self.rootMove, 'value': self.rootValue, 'pv': list(self.pv), 'depth': self.depthDone, 'nodes': self.nodes, 'seconds': elapsed,
+                'nodesPerSec': self.nodes / elapsed if elapsed > 0 else 0}
+
+        pv = []
+        node = self.root
+        while node.bestChild is not None:
+            node = node.bestChild
+            pv.append(node.parentMoveVal)
+
+        ret = {'move': None, 'value': None, 'pv': pv, 'depth': self.depthDone, 'nodes': self.nodes, 'seconds': elapsed,
+            'nodesPerSec': self.nodes / elapsed if elapsed > 0 else 0}
+        if self.root.bestChild is not None:
+            ret['move'] = self.root.bestChild.parentMoveVal
+            ret['value'] = self.root.bestChild.reward
+        return ret
+
+    def report(self, force=False): # the callback only runs every interval seconds
+        if self.callback is None or (not force and time.time() < self.nextReport):
+            return
+        self.nextReport = time.time() + self.interval
+        if self.callback(self.progress()):
+            self.stopSearch = True
+            if not force:
+                raise SearchTimeout
 
     def minimax(self, node, depth=0, alpha=-np.inf, beta=np.inf):
-        reward = node.isTerminal(depth, self.depth)
+        if self.inPlace and depth > 0: # the root's children stay nodes so play() can pick one, everything under them is searched in place
+            node.bestChild = None
+            node.reward = self.searchState(node.state, depth, alpha, beta, node.parentIsAI)
+            return
+
+        self.checkBudget()
+        node.bestChild = None # left over from an earlier, shallower search
+        try:
+            key = None if self.table is None else node.state.key()
+            ttMove = None
+            if key is not None:
+                entry = self.table.probe(key)
+                if entry is not None:
+                    ttDepth, flag, value, ttMove = entry
+                    # the root always searches, it has to pick a child
+                    if depth > 0 and ttDepth >= self.searchDepth - depth and (flag == exact or (flag == lowerBound and value >= beta) or (flag == upperBound and value <= alpha)):
+                        node.reward = value
+                        return
+
+            alphaOrig, betaOrig = alpha, beta
+            reward = node.isTerminal(depth, self.searchDepth)
+            if reward is not None and reward is not False:
+                node.reward = reward
+                flag = exact
+            else:
+                searched = len(node.children) > 0
+                if not searched:
+                    node.genChildren()
+
+                # best first by what the previous iteration found, and the table's best move ahead of everything
+                moves = sorted(node.children, key=lambda move: node.children[move].reward, reverse=node.parentIsAI)
+                children = [node.children[move] for move in self.orderMoves(moves, depth, ttMove, searched)]
+                self.interiorNodes += 1
+                for i, child in enumerate(children):
+                    self.minimax(child, depth + 1, alpha, beta)
+
+                    if node.bestChild is None or (node.parentIsAI and child.reward > node.bestChild.reward) or ((not node.parentIsAI) and child.reward < node.bestChild.reward):
+                        node.bestChild = child
+                        if node.parentIsAI: # the first child narrows the window too, that's where good ordering pays off
+                            alpha = max(alpha, child.reward)
+                        else:
+                            beta = min(beta, child.reward)
+                        if beta <= alpha:
+                            self.cutoff(child.parentMoveVal, depth, i)
+                            break
+                node.reward = node.bestChild.reward
+                if node.reward <= alphaOrig:
+                    flag = upperBound
+                elif node.reward >= betaOrig:
+                    flag = lowerBound
+                else:
+                    flag = exact
+            if key is not None:
+                self.table.store(key, self.searchDepth - depth, flag, node.reward, None if node.bestChild is None else node.bestChild.parentMoveVal)
+        except SearchTimeout:
+            if depth > 0: # below the root a cut-off search has no valid result; the root keeps its best fully searched child
+                node.bestChild = None
+            raise
+
+    def orderMoves(self, moves, depth, ttMove=None, ordered=False): # the table's move, then this ply's killers, then the rest by history unless they come ordered already
+        moves = list(moves)
+        if self.history and not ordered:
+            moves.sort(key=lambda move: self.historyTable.get(move, 0), reverse=True)
+        for move in self.killerMoves.get(depth, [])[::-1] + [ttMove]:
+            if move is not None and move in moves:
+                moves.remove(move)
+                moves.insert(0, move)
+        return moves
+
+    def cutoff(self, move, depth, i): # move was good enough to stop the search at this ply
+        self.cutoffs += 1
+        self.firstCutoffs += i == 0
+        if self.killers > 0:
+            slots = self.killerMoves.setdefault(depth, [])
+            if move in slots:
+                slots.remove(move)
+            slots.insert(0, move)
+            del slots[self.killers:]
+        if self.history: # cutoffs far from the leaves save the most, so they count for more
+            self.historyTable[move] = self.historyTable.get(move, 0) + (self.searchDepth - depth) ** 2
+
+    def searchState(self, state, depth, alpha, beta, maximizing): # minimax on a single state, every move is undone before the next is tried
+        if self.pvs: # negamax scores for the side to move, so the minimizing side sees the window and value negated
+            color = 1 if maximizing else -1
+            if maximizing:
+                return self.negamax(state, depth, alpha, beta, color)
+            return -self.negamax(state, depth, -beta, -alpha, color)
+
+        self.checkBudget()
+        key = None if self.table is None else state.key()
+        ttMove = None
+        if key is not None:
+            entry = self.table.probe(key)
+            if entry is not None:
+                ttDepth, flag, value, ttMove = entry
+                if ttDepth >= self.searchDepth - depth and (flag == exact or (flag == lowerBound and value >= beta) or (flag == upperBound and value <= alpha)):
+                    return value
+
+        alphaOrig, betaOrig = alpha, beta
+        bestMove = None
+        reward = state.isTerminal(depth, self.searchDepth)
         if reward is not None and reward is not False:
-            node.reward = reward
+            flag = exact
         else:
-            if len(node.children) == 0:
-                node.genChildren()
+            moves = self.orderMoves(state.listMoves(), depth, ttMove)
+            self.interiorNodes += 1
+            reward = None
+            for i, move in enumerate(moves):
+                record = state.makeMove(move)
+                try:
+                    value = self.searchState(state, depth + 1, alpha, beta, not maximizing)
+                finally: # a cut-off search still has to hand the state back as it found it
+                    state.undoMove(move, record)
 
-            for child in node.children:
-                self.minimax(child, depth + 1, alpha, beta)
-
-                if node.bestChild is None:
-                    node.bestChild = child
-                elif node.parentIsAI and child.reward > node.bestChild.reward:
-                    node.bestChild = child
-                    alpha = child.reward
-                    if beta <= alpha:
-                        break
-                elif (not node.parentIsAI) and child.reward < node.bestChild.reward:
-                    node.bestChild = child
-                    beta = child.reward
+                if reward is None or (maximizing and value > reward) or ((not maximizing) and value < reward):
+                    reward = value
+                    bestMove = move
+                    if maximizing:
+                        alpha = max(alpha, value)
+                    else:
+                        beta = min(beta, value)
                     if beta <= alpha:
+                        self.cutoff(move, depth, i)
                         break
-            node.reward = node.bestChild.reward
+            if reward <= alphaOrig:
+                flag = upperBound
+            elif reward >= betaOrig:
+                flag = lowerBound
+            else:
+                flag = exact
+        if key is not None:
+            self.table.store(key, self.searchDepth - depth, flag, reward, bestMove)
+        return reward
+
+    def negamax(self, state, depth, alpha, beta, color): # value for the side to move, color is 1 when that's the AI
+        self.checkBudget()
+        key = None if self.table is None else state.key()
+        ttMove = None
+        if key is not None: # the key includes the side to move, so stored values are always that side's
+            entry = self.table.probe(key)
+            if entry is not None:
+                ttDepth, flag, value, ttMove = entry
+                if ttDepth >= self.searchDepth - depth and (flag == exact or (flag == lowerBound and value >= beta) or (flag == upperBound and value <= alpha)):
+                    return value
+
+        alphaOrig = alpha
+        bestMove = None
+        reward = state.isTerminal(depth, self.searchDepth)
+        if reward is not None and reward is not False:
+            value = color * reward
+            flag = exact
+        else:
+            moves = self.orderMoves(state.listMoves(), depth, ttMove)
+            self.interiorNodes += 1
+            value = None
+            for i, move in enumerate(moves):
+                record = state.makeMove(move)
+                try:
+                    if bestMove is None: # the first move is expected to be best and gets the full window
+                        score = -self.negamax(state, depth + 1, -beta, -alpha, -color)
+                    else: # the rest only have to be shown no better than alpha
+                        score = -self.negamax(state, depth + 1, -alpha - nullWindow, -alpha, -color)
+                        if alpha < score < beta: # it was better after all, so find out by how much
+                            self.researches += 1
+                            score = -self.negamax(state, depth + 1, -beta, -score, -color)
+                finally:
+                    state.undoMove(move, record)
+
+                if value is None or score > value:
+                    value = score
+                    bestMove = move
+                alpha = max(alpha, score)
+                if alpha >= beta:
+                    self.cutoff(move, depth, i)
+                    break
+            if value <= alphaOrig:
+                flag = upperBound
+            elif value >= beta:
+                flag = lowerBound
+            else:
+                flag = exact
+        if key is not None:
+            self.table.store(key, self.searchDepth - depth, flag, value, bestMove)
+        return value
+
+    def searchRoot(self, state, maximizing, prevMove=None, alpha=-np.inf, beta=np.inf): # searchState for the root, which also has to say which move is best
+        self.checkBudget()
+        moves = list(state.listMoves())
+        if prevMove in moves: # the last iteration's best move goes first
+            moves.remove(prevMove)
+            moves.insert(0, prevMove)
+
+        alphaOrig, betaOrig = alpha, beta
+        for move in moves:
+            record = state.makeMove(move)
+            try:
+                value = self.searchState(state, 1, alpha, beta, not maximizing)
+            finally:
+                state.undoMove(move, record)
+
+            if self.rootMove is None or (maximizing and value > self.rootValue) or ((not maximizing) and value < self.rootValue):
+                self.rootMove = move
+                self.rootValue = value
+                if maximizing:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if beta <= alpha: # only inside an aspiration window, the full window never closes at the root
+                    break
+        if self.rootValue <= alphaOrig:
+            flag = upperBound
+        elif self.rootValue >= betaOrig:
+            flag = lowerBound
+        else:
+            flag = exact
+        key = None if self.table is None else state.key()
+        if key is not None:
+            if self.pvs and not maximizing: # negamax reads this entry as the side to move's value
+                flag = {exact: exact, lowerBound: upperBound, upperBound: lowerBound}[flag]
+                self.table.store(key, self.searchDepth, flag, -self.rootValue, self.rootMove)
+            else:
+                self.table.store(key, self.searchDepth, flag, self.rootValue, self.rootMove)
+        return alphaOrig < self.rootValue < betaOrig
+
+    def principalVariation(self, state, table=None): # the root move followed by the table's best reply in each position after it
+        if table is None:
+            table = self.table
+        pv = []
+        made = []
+        move = self.rootMove
+        while move is not None and len(pv) < max(self.depthDone, 1):
+            pv.append(move)
+            made.append((move, state.makeMove(move)))
+            key = None if table is None else state.key()
+            entry = None if key is None else table.probe(key)
+            move = None if entry is None else entry[3]
+        for move, record in reversed(made):
+            state.undoMove(move, record)
+        return pv
+
+    def deepen(self): # iterative deepening over the node tree, the root keeps the best move found when the budget runs out
+        best = None
+        try:
+            for searchDepth in range(1 if self.iterative else self.depth, self.depth + 1): # each iteration orders moves by the last one's results
+                self.searchDepth = searchDepth
+                self.minimax(self.root)
+                best = self.root.bestChild
+                self.depthDone = searchDepth
+        except SearchTimeout:
+            if self.root.bestChild is None: # the cut-off iteration didn't finish a root move, so play the last finished depth's choice
+                self.root.bestChild = best
+            if self.root.bestChild is None: # not even one root move finished, so play any of them
+                self.root.bestChild = next(iter(self.root.children.values()))
+
+    def deepenState(self): # the same over one copy of the root state, memory stays at one state plus the moves on the current path
+        state = self.root.state.copy()
+        maximizing = self.root.parentIsAI
+        best = None
+        self.rootMove = None
+        self.pv = []
+        try:
+            for searchDepth in range(1 if self.iterative else self.depth, self.depth + 1):
+                self.searchDepth = searchDepth
+                self.rootMove = None
+                prevMove = None if best is None else best[0]
+                if self.aspiration is not None and best is not None and best[1] is not None:
+                    if not self.searchRoot(state, maximizing, prevMove, best[1] - self.aspiration, best[1] + self.aspiration):
+                        self.aspirationFails += 1 # the value fell outside the window and is only a bound, so search again with all of it
+                        self.rootMove = None
+                        self.searchRoot(state, maximizing, prevMove)
+                else:
+                    self.searchRoot(state, maximizing, prevMove)
+                best = (self.rootMove, self.rootValue)
+                self.depthDone = searchDepth
+                self.pv = self.principalVariation(state)
+        except SearchTimeout:
+            if self.rootMove is None:
+                if best is not None:
+                    self.rootMove, self.rootValue = best
+                else:
+                    self.rootMove, self.rootValue = next(iter(state.listMoves())), None
+        self.pv = self.principalVariation(state)
+
+    def play(self, state, playerMove=None, timeBudget=None, nodeBudget=None, callback=None, interval=None):
+        if not self.keepTree: # no tree to walk down or collect, the search starts from the position passed in and the move goes back as a lone node
+            self.root = self.nodeClass(parentIsAI=True, state=state.copy())
+            self.search(timeBudget, nodeBudget, callback, interval)
+            bestChild = self.nodeClass(self.rootMove, state=self.root.state.findState(self.rootMove), parentIsAI=False)
+            bestChild.reward = self.rootValue
+            print('Best Child\'s reward:', bestChild.reward)
+            return bestChild, bestChild.reward
 
-    def play(self, state, playerMove=None):
         if playerMove is not None and len(self.root.children) > 0:
             self.root = self.root.findChild(playerMove)
         else:
@@ -148,9 +578,149 @@ class Minimax:
         if self.root.bestChild is None:
             self.root.parent = None
             gc.collect()
-            self.minimax(self.root)
+            if len(self.root.children) == 0:
+                self.root.genChildren()
+            self.search(timeBudget, nodeBudget, callback, interval)
 
         bestChild = self.root.bestChild
 
         print('Best Child\'s reward:', bestChild.reward)
         return bestChild, bestChild.reward
+
+    def iterPlay(self, state, playerMove=None, timeBudget=None, nodeBudget=None, interval=None): # play as a generator of progress reports, the last one holding play's result
+        updates = queue.Queue()
+        stopped = threading.Event()
+
+        def callback(info):
+            updates.put(info)
+            return stopped.is_set()
+
+        def run():
+            try:
+                updates.put({'result': self.play(state, playerMove, timeBudget, nodeBudget, callback, interval)})
+            except BaseException as e:
+                updates.put({'error': e})
+
+        self.stopSearch = False
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                info = updates.get()
+                if 'error' in info:
+                    raise info['error']
+                yield info
+                if 'result' in info:
+                    break
+        finally: # the caller stopped iterating, so cut the search off and play the best move found so far
+            stopped.set()
+            self.stopSearch = True # set even if the search hasn't started yet, it stops as soon as it does
+            thread.join()
+            self.stopSearch = False
+
+    def ponder(self): # full-depth searches of the player's replies to the current root, the predicted one first
+        if not self.keepTree: # no replies are kept, so search the predicted one and leave its results in the table
+            if self.table is None or len(self.pv) < 2:
+                return
+            state = self.root.state.findState(self.pv[1])
+            self.searchDepth = self.depth
+            self.rootMove = None
+            try:
+                self.searchRoot(state, not self.root.parentIsAI)
+                print('Pondered the predicted reply', self.pv[1])
+            except SearchTimeout:
+                pass
+            return
+
+        replies = list(self.root.children.values())
+        if self.root.bestChild in replies:
+            replies.remove(self.root.bestChild)
+            replies.insert(0, self.root.bestChild)
+
+        self.searchDepth = self.depth
+        done = 0
+        for reply in replies:
+            if len(reply.children) == 0:
+                reply.genChildren()
+            try:
+                self.minimax(reply)
+            except SearchTimeout: # a cut-off search isn't a result, play() will search this reply again
+                reply.bestChild = None
+                break
+            done += 1
+        print('Pondered {} of {} replies'.format(done, len(replies)))
+
+    def startPonder(self): # play() skips the search for any reply that pondering already finished
+        self.ponderStop = False
+        self.stopSearch = False
+        self.ponderThread = threading.Thread(target=self.ponder, daemon=True)
+        self.ponderThread.start()
+
+    def stopPonder(self):
+        self.ponderStop = True
+        self.ponderThread.join()
+        self.ponderThread = None
+        self.ponderStop = False
+
+    def search(self, timeBudget=None, nodeBudget=None, callback=None, interval=None): # returns early with the best root move found when the budget runs out
+        if timeBudget is None:
+            timeBudget = self.timeBudget
+        if nodeBudget is None:
+            nodeBudget = self.nodeBudget
+
+        start = time.time()
+        self.deadline = None if timeBudget is None else start + timeBudget
+        self.nodeLimit = nodeBudget
+        self.nodes = 0
+        self.callback = callback
+        if interval is not None:
+            self.interval = interval
+        self.searchStart = start
+        self.nextReport = start + self.interval
+        if self.table is not None:
+            self.table.newSearch()
+        self.depthDone = 0
+        self.researches = 0
+        self.aspirationFails = 0
+        self.cutoffs = 0
+        self.firstCutoffs = 0
+        self.interiorNodes = 0
+        for move in self.historyTable: # older cutoffs count for less
+            self.historyTable[move] /= 2
+        try:
+            if self.keepTree:
+                self.deepen()
+            else:
+                self.deepenState()
+        finally:
+            self.deadline = None
+            self.nodeLimit = None
+        try:
+            self.report(force=True)
+        finally:
+            self.callback = None
+            self.stopSearch = False # a stop request only ends the search it came in during
+
+        elapsed = time.time() - start
+        used = None
+        if timeBudget is not None:
+            used = min(elapsed / timeBudget, 1)
+        if nodeBudget is not None:
+            used = max(used or 0, min(self.nodes / nodeBudget, 1))
+        self.budgetUsed = {'nodes': self.nodes, 'seconds': elapsed, 'fraction': used, 'depth': self.depthDone,
+            'nodesPerSec': self.nodes / elapsed if elapsed > 0 else 0}
+        if used is None:
+            print('Searched {} nodes to depth {} in {}s'.format(self.nodes, self.depthDone, round(elapsed, 3)))
+        else:
+            print('Used {}% of the budget | {} nodes to depth {} in {}s'.format(round(used * 100, 1), self.nodes, self.depthDone, round(elapsed, 3)))
+        if self.table is not None:
+            self.budgetUsed['tableHitRate'] = self.table.hitRate()
+            print('Transposition table: {} hits in {} probes ({}%)'.format(self.table.hits, self.table.probes, round(self.table.hitRate() * 100, 1)))
+        if self.interiorNodes > 0:
+            self.budgetUsed['cutoffRate'] = self.cutoffs / self.interiorNodes
+            self.budgetUsed['firstCutoffRate'] = self.firstCutoffs / self.cutoffs if self.cutoffs > 0 else 0
+            print('Cutoffs at {}% of interior nodes, {}% of them on the first move'.format(round(self.budgetUsed['cutoffRate'] * 100, 1), round(self.budgetUsed['firstCutoffRate'] * 100, 1)))
+        if self.pvs:
+            self.budgetUsed['researches'] = self.researches
+            self.budgetUsed['aspirationFails'] = self.aspirationFails
+            print('Null-window re-searches: {} | aspiration window misses: {}'.format(self.researches, self.aspirationFails))
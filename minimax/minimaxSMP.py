@@ -0,0 +1,201 @@
+# Lazy SMP: N processes search the same root with the tree-free search, sharing one transposition table in shared memory
+
+from multiprocessing import Array, Process, Queue, Event, cpu_count
+from multiprocessing.shared_memory import SharedMemory
+from minimax import *
+
+class SharedTranspositionTable(TranspositionTable): # entries are written without locks, so each key is stored xor'd with a checksum of its entry and a torn one reads as a miss
+    def __init__(self, size=2**16, names=None):
+        assert size & (size - 1) == 0
+        self.size = size
+        self.blocks = []
+        self.owner = names is None
+        for i, (name, dtype, fill) in enumerate(TranspositionTable.fields):
+            if self.owner:
+                block = SharedMemory(create=True, size=size * np.dtype(dtype).itemsize)
+            else:
+                block = SharedMemory(name=names[i])
+            arr = np.ndarray(size, dtype=dtype, buffer=block.buf)
+            if self.owner:
+                arr[:] = fill
+            setattr(self, name, arr)
+            self.blocks.append(block)
+        self.names = [block.name for block in self.blocks]
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def checksum(depths, flags, values, moves): # every field's bits folded into one word, for a single entry or whole arrays
+        ret = np.asarray(values, dtype=np.float64).view(np.uint64)
+        ret = ret ^ (np.asarray(depths).astype(np.uint64) << np.uint64(48)) ^ (np.asarray(flags).astype(np.uint64) << np.uint64(40))
+        return ret ^ (np.asarray(moves).astype(np.int64).astype(np.uint64) & np.uint64(0xffff))
+
+    def entry(self, idx): # (key, depth, flag, value, move) as last written to the slot, the key comes out wrong if writers tore the entry
+        depth, flag, value, move = self.depths[idx], self.flags[idx], self.values[idx], self.moves[idx]
+        key = int(self.keys[idx] ^ SharedTranspositionTable.checksum(depth, flag, value, move))
+        return key, int(depth), int(flag), float(value), int(move)
+
+    def probe(self, key):
+        self.probes += 1
+        idx = key & (self.size - 1)
+        storedKey, depth, flag, value, move = self.entry(idx)
+        if depth < 0 or storedKey != key:
+            return None
+        self.hits += 1
+        return depth, flag, value, None if move == noMove else move
+
+    def store(self, key, depth, flag, value, move):
+        idx = key & (self.size - 1)
+        storedKey, storedDepth = self.entry(idx)[:2]
+        if storedDepth >= 0 and storedKey != key and self.ages[idx] == self.age and storedDepth > depth:
+            return
+        move = noMove if move is None else int(move)
+        check = SharedTranspositionTable.checksum(np.int16(depth), np.int8(flag), np.float64(value), np.int16(move)) # from what this writer stores, re-reading the slot could pick up another writer's fields
+        self.depths[idx] = depth
+        self.flags[idx] = flag
+        self.values[idx] = value
+        self.moves[idx] = move
+        self.ages[idx] = self.age
+        self.keys[idx] = np.uint64(key) ^ check
+
+    @classmethod
+    def fromTable(cls, table):
+        ret = cls(table.size)
+        for name, dtype, fill in TranspositionTable.fields:
+            getattr(ret, name)[:] = getattr(table, name)
+        ret.keys[:] = table.keys ^ cls.checksum(table.depths, table.flags, table.values, table.moves)
+        ret.age = table.age
+        return ret
+
+    def toTable(self): # a plain TranspositionTable copy, which pickles with the engine
+        ret = TranspositionTable(self.size)
+        for name, dtype, fill in TranspositionTable.fields:
+            getattr(ret, name)[:] = getattr(self, name)
+        ret.keys[:] = self.keys ^ SharedTranspositionTable.checksum(self.depths, self.flags, self.values, self.moves)
+        ret.age = self.age
+        return ret
+
+    def close(self):
+        for name, dtype, fill in TranspositionTable.fields:
+            setattr(self, name, None) # a block can't be closed while arrays still point into it
+        for block in self.blocks:
+            block.close()
+            if self.owner:
+                block.unlink()
+
+def smpWorker(names, size, age, game, nodeClass, rootState, rootParentIsAI, depth, firstDepth, deadline, nodeLimit, pvs, stop, nodeCounts, results, worker, seed):
+    random.seed(seed)
+    ai = Minimax(game, nodeClass, rootState, depth=depth, tableSize=None, keepTree=False, pvs=pvs)
+    ai.root = nodeClass(state=rootState, parentIsAI=rootParentIsAI)
+    ai.table = SharedTranspositionTable(size, names)
+    ai.table.age = age
+    ai.deadline = deadline
+    ai.nodeLimit = nodeLimit
+    def callback(info): # polled every 64 nodes, the main process sets stop once some worker finishes the last depth
+        nodeCounts[worker] = ai.nodes # so the main process can report nodes searched so far
+        return stop.is_set()
+
+    ai.callback = callback
+    ai.interval = 0
+    ai.searchStart = time.time()
+    state = ai.root.state
+    maximizing = ai.root.parentIsAI
+    prevMove = None
+    if worker > 0: # helpers lead with a random root move the first time, so they don't all walk the main worker's path
+        prevMove = random.choice(sorted(state.listMoves()))
+    try:
+        for searchDepth in range(firstDepth, depth + 1):
+            ai.searchDepth = searchDepth
+            ai.rootMove = None
+            ai.searchRoot(state, maximizing, prevMove)
+            prevMove = ai.rootMove
+            results.put(('depth', worker, searchDepth, ai.rootMove, ai.rootValue))
+    except SearchTimeout:
+        pass
+    finally: # the main process waits on this, so it goes out even if the search fails
+        nodeCounts[worker] = ai.nodes
+        results.put(('done', worker, ai.nodes, ai.table.probes, ai.table.hits))
+        ai.table.close()
+
+class SMPMinimax(Minimax): # drop-in for Minimax, e.g. oth.fightAI(OthNode, engine=SMPMinimax), searching without a tree
+    def __init__(self, game, nodeClass, initialState, depth=4, timeBudget=None, nodeBudget=None, tableSize=2**16, iterative=True, pvs=False, numWorkers=None):
+        super().__init__(game, nodeClass, initialState, depth, timeBudget, nodeBudget, tableSize, iterative, keepTree=False, pvs=pvs)
+        assert self.table is not None # the table is all the workers share
+        if numWorkers is None:
+            numWorkers = cpu_count()
+        self.numWorkers = numWorkers
+        self.workerDepths = None # deepest depth each worker finished in the last search
+
+    def deepenState(self): # the result is the deepest one any worker finished, the main worker's on a tie
+        if self.numWorkers <= 1: # one worker is exactly the serial search, and as deterministic
+            return super().deepenState()
+
+        shared = SharedTranspositionTable.fromTable(self.table)
+        stop = Event()
+        results = Queue()
+        nodeCounts = Array('q', self.numWorkers, lock=False) # each worker's nodes so far, written without locks since only it writes its own
+        nodesBefore = self.nodes
+        state = self.root.state.copy()
+        best = None
+        self.workerDepths = [0] * self.numWorkers
+        self.rootMove = None
+        self.pv = []
+        try:
+            procs = []
+            for i in range(self.numWorkers):
+                firstDepth = self.depth if not self.iterative else min(1 + i % 2, self.depth) # odd workers run one ply ahead
+                nodeLimit = None
+                if self.nodeLimit is not None: # the budget is split, so all workers together search no more than one would
+                    nodeLimit = self.nodeLimit // self.numWorkers + (i < self.nodeLimit % self.numWorkers)
+                args = (shared.names, shared.size, shared.age, self.game, self.nodeClass, self.root.state, self.root.parentIsAI, self.depth, firstDepth, self.deadline,
+                    nodeLimit, self.pvs, stop, nodeCounts, results, i, random.randrange(2**32))
+                p = Process(target=smpWorker, args=args, daemon=True)
+                p.start()
+                procs.append(p)
+
+            probes = hits = 0
+            running = self.numWorkers
+            while running > 0:
+                try:
+                    msg = results.get(timeout=0.05)
+                except queue.Empty:
+                    if self.stopSearch or self.ponderStop or (self.deadline is not None and time.time() > self.deadline):
+                        stop.set()
+                    elif self.callback is not None: # between finished depths too, so the interval holds and a stop request gets through
+                        self.nodes = nodesBefore + sum(nodeCounts)
+                        try:
+                            self.report()
+                        except SearchTimeout:
+                            stop.set()
+                    continue
+                if msg[0] == 'done':
+                    probes += msg[3]
+                    hits += msg[4]
+                    running -= 1
+                    continue
+
+                _, worker, depth, move, value = msg
+                self.workerDepths[worker] = depth
+                if best is None or depth > best[0] or (depth == best[0] and worker < best[1]):
+                    best = (depth, worker, move, value)
+                    self.rootMove, self.rootValue, self.depthDone = move, value, depth
+                    self.pv = self.principalVariation(state, shared)
+                if depth >= self.depth:
+                    stop.set()
+                if self.callback is not None:
+                    self.nodes = nodesBefore + sum(nodeCounts)
+                    try:
+                        self.report()
+                    except SearchTimeout:
+                        stop.set()
+            for p in procs:
+                p.join()
+            self.nodes = nodesBefore + sum(nodeCounts)
+            self.table = shared.toTable()
+            self.table.probes, self.table.hits = probes, hits
+        finally:
+            shared.close()
+
+        if self.rootMove is None: # no worker finished even one depth
+            self.rootMove, self.rootValue = next(iter(state.listMoves())), None
+        self.pv = self.principalVariation(state)
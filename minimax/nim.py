@@ -32,6 +32,17 @@ class NimState(State):
             return -1
         return None
 
+    def makeMove(self, move):
+        self.update(move)
+        return None
+
+    def undoMove(self, move, record):
+        self.state += move
+        self.parentIsAI = not self.parentIsAI
+
+    def listMoves(self):
+        return set(range(1, min(4, self.state+1)))
+
     def copy(self):
         ret = NimState(state=self.state)
         ret.parentIsAI = self.parentIsAI
@@ -39,7 +50,7 @@ class NimState(State):
 
 class NimNode(Node):
     def listMoves(self):
-        return set(range(1, min(4, self.state.state+1))) # method implementation varies from game to game
+        return self.state.listMoves() # method implementation varies from game to game
 
 class Nim(Game):
     def __init__(self, numStart=11):
@@ -73,5 +84,6 @@ class Nim(Game):
         if (won and not node.parentIsAI) or (not won and node.parentIsAI):
             return loseReward
 
-nim = Nim()
-nim.fightAI(NimNode)
+if __name__ == '__main__':
+    nim = Nim()
+    nim.fightAI(NimNode)
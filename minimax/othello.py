@@ -7,6 +7,67 @@ mid = boardLen // 2
 signs = {0: '.', -1: '++', 1: 'oo'}
 readableSigns = {0: '.', -1: '+', 1: 'o'}
 neighbors = {(0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (-1, 1), (1, -1), (-1, -1)}
+pieceKeys, sideKey = zobristKeys(2, boardLen ** 2) # index 0 for black (-1), 1 for white (1)
+flipKeys = [pieceKeys[0][sq] ^ pieceKeys[1][sq] for sq in range(boardLen ** 2)]
+
+# bitboards: bit y * boardLen + x is square (y, x); masks stop a shift from wrapping a row's end onto the next row
+full = (1 << boardLen ** 2) - 1
+notFirstCol = full & ~sum(1 << (y * boardLen) for y in range(boardLen))
+notLastCol = full & ~sum(1 << (y * boardLen + boardLen - 1) for y in range(boardLen))
+shifts = ((1, notFirstCol), (-1, notLastCol), (boardLen, full), (-boardLen, full),
+    (boardLen + 1, notFirstCol), (boardLen - 1, notLastCol), (-boardLen + 1, notFirstCol), (-boardLen - 1, notLastCol))
+
+adjVal = lambda x: (mid - x) if x < mid else (x - mid + 1)
+addVal = lambda x: (2 ** x) if x % 2 == 0 else -(2 ** x) # the most neg. value will be -2 since -(3 * 2/3) = -2
+squareWeights = [addVal(adjVal(sq // boardLen)) + addVal(adjVal(sq % boardLen)) for sq in range(boardLen ** 2)] # evalPieces' positional score per square
+rowWeights = [[sum(squareWeights[row * boardLen + x] for x in range(boardLen) if byte >> x & 1) for byte in range(2 ** boardLen)] for row in range(boardLen)]
+
+def shift(bits, d, mask):
+    return ((bits << d) if d > 0 else (bits >> -d)) & mask
+
+def moveBits(me, opp): # every empty square bracketing a line of opp's discs with one of me's, each direction flooded a whole line at a time
+    ret = 0
+    for d, mask in shifts: # unrolled, a line holds at most boardLen - 2 discs to flip
+        line = opp & mask
+        if d > 0:
+            run = (me << d) & line
+            run |= (run << d) & line
+            run |= (run << d) & line
+            run |= (run << d) & line
+            run |= (run << d) & line
+            run |= (run << d) & line
+            ret |= (run << d) & mask
+        else:
+            d = -d
+            run = (me >> d) & line
+            run |= (run >> d) & line
+            run |= (run >> d) & line
+            run |= (run >> d) & line
+            run |= (run >> d) & line
+            run |= (run >> d) & line
+            ret |= (run >> d) & mask
+    return ret & ~(me | opp)
+
+def flipBits(me, opp, sq): # opp's discs flipped by me playing sq
+    ret = 0
+    for d, mask in shifts:
+        run = 0
+        bit = shift(1 << sq, d, mask)
+        while bit & opp:
+            run |= bit
+            bit = shift(bit, d, mask)
+        if bit & me:
+            ret |= run
+    return ret
+
+def bitSquares(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+def weighBits(bits): # summed squareWeights of the set squares, a row at a time
+    return sum(rowWeights[row][(bits >> (row * boardLen)) & (2 ** boardLen - 1)] for row in range(boardLen))
 
 class OthState(State):
     def __init__(self, state=None, parentIsAI=False):
@@ -17,11 +78,24 @@ class OthState(State):
 
             self.blackPos = {(mid-1, mid), (mid, mid-1)}
             self.whitePos = {(mid-1, mid-1), (mid, mid)}
+            self.hash = 0
+            self.score = 0 # squareWeights summed over white's discs minus black's, kept up to date as discs are placed and flipped
+            for y, x in self.blackPos:
+                self.hash ^= pieceKeys[0][y * boardLen + x]
+                self.score -= squareWeights[y * boardLen + x]
+            for y, x in self.whitePos:
+                self.hash ^= pieceKeys[1][y * boardLen + x]
+                self.score += squareWeights[y * boardLen + x]
+            self.moveCache = {} # parentIsAI -> listMoves for this position, emptied whenever a disc changes
 
     def update(self, move):
-        if move == -1:
+        self.makeMove(move)
+
+    def makeMove(self, move): # returns the squares flipped and the move lists cached for the position being left, which is all undoMove needs
+        cache = self.moveCache
+        if move == -1: # the board doesn't change, so neither do its move lists
             self.parentIsAI = not self.parentIsAI
-            return
+            return None, cache
 
         y, x = move // boardLen, move % boardLen
         assert self.state[y][x] == 0
@@ -29,16 +103,44 @@ class OthState(State):
         if self.parentIsAI:
             self.state[y][x] = 1
             self.whitePos.add((y, x))
+            self.hash ^= pieceKeys[1][move]
+            self.score += squareWeights[move]
         else:
             self.state[y][x] = -1
             self.blackPos.add((y, x))
+            self.hash ^= pieceKeys[0][move]
+            self.score -= squareWeights[move]
 
-        movePatch = set()
+        flipped = []
         for stepY, stepX in neighbors:
             if self.check(y, x, stepY, stepX):
-                self.fill(y, x, stepY, stepX)
+                self.fill(y, x, stepY, stepX, flipped)
 
         self.parentIsAI = not self.parentIsAI
+        self.moveCache = {}
+        return flipped, cache
+
+    def undoMove(self, move, record):
+        flipped, self.moveCache = record
+        self.parentIsAI = not self.parentIsAI
+        if move == -1:
+            return
+
+        y, x = move // boardLen, move % boardLen
+        self.state[y][x] = 0
+        if self.parentIsAI:
+            myMoves, oppMoves, piece, sign = self.whitePos, self.blackPos, 1, 1
+        else:
+            myMoves, oppMoves, piece, sign = self.blackPos, self.whitePos, 0, -1
+        myMoves.remove((y, x))
+        self.hash ^= pieceKeys[piece][move]
+        self.score -= sign * squareWeights[move]
+        for y, x in flipped:
+            myMoves.remove((y, x))
+            oppMoves.add((y, x))
+            self.state[y][x] *= -1
+            self.hash ^= pieceKeys[0][y * boardLen + x] ^ pieceKeys[1][y * boardLen + x]
+            self.score -= 2 * sign * squareWeights[y * boardLen + x]
 
     def isTerminal(self, depth, maxDepth):
         numBlacks = len(self.blackPos)
@@ -46,15 +148,15 @@ class OthState(State):
 
         if depth >= maxDepth:
             #return (numWhites - numBlacks) / boardLen ** 2
-            return self.evalPieces()
+            return self.evalPieces(True) # always white's (the AI's) view, an odd-depth horizon would otherwise score for the wrong side
 
         if numBlacks == 0:
             return 999
         if numWhites == 0:
             return -999
 
-        if np.sum(np.abs(self.state)) == boardLen ** 2 or self.listMoves(False) == self.listMoves(True) == {-1,}:
-            return 999 * np.sign(numWhites - numBlacks).astype(np.int8)
+        if numBlacks + numWhites == boardLen ** 2 or self.listMoves(False) == self.listMoves(True) == {-1,}:
+            return 999 * int(np.sign(numWhites - numBlacks))
         return None
 
     def copy(self):
@@ -63,8 +165,14 @@ class OthState(State):
         ret.parentIsAI = self.parentIsAI
         ret.blackPos = self.blackPos.copy()
         ret.whitePos = self.whitePos.copy()
+        ret.hash = self.hash
+        ret.score = self.score
+        ret.moveCache = dict(self.moveCache)
         return ret
 
+    def key(self):
+        return self.hash ^ sideKey if self.parentIsAI else self.hash
+
     def coordToMove(moveList):
         ret = set()
         for move in moveList:
@@ -96,13 +204,15 @@ class OthState(State):
         if (y, x) in myMoves:
             return True
 
-    def fill(self, y, x, stepY, stepX): # checks if a player's token is by the direction starting from (x, y) with slope=stepY/stepX
+    def fill(self, y, x, stepY, stepX, flipped=None): # checks if a player's token is by the direction starting from (x, y) with slope=stepY/stepX
         if self.parentIsAI:
             myMoves = self.whitePos
             oppMoves = self.blackPos
+            sign = 1
         else:
             myMoves = self.blackPos
             oppMoves = self.whitePos
+            sign = -1
 
         y += stepY
         x += stepX
@@ -110,33 +220,31 @@ class OthState(State):
             oppMoves.remove((y, x))
             myMoves.add((y, x))
             self.state[y][x] *= -1
+            self.hash ^= pieceKeys[0][y * boardLen + x] ^ pieceKeys[1][y * boardLen + x] # a flip swaps one colour's key for the other's
+            self.score += 2 * sign * squareWeights[y * boardLen + x] # and one side's weight for the other's
+            if flipped is not None:
+                flipped.append((y, x))
             y += stepY
             x += stepX
 
     def evalPieces(self, parentIsAI=None):
-        myMoves, oppMoves = self.whatsMyMoves(parentIsAI)
-        adjVal = lambda x: (mid - x) if x < mid else (x - mid + 1)
-        addVal = lambda x: (2 ** x) if x % 2 == 0 else -(2 ** x) # the most neg. value will be -2 since -(3 * 2/3) = -2
-
-        myMoveAccum = 0
-        for y, x in myMoves:
-            y = adjVal(y)
-            x = adjVal(x)
-            myMoveAccum += addVal(y)
-            myMoveAccum += addVal(x)
-
-        oppMoveAccum = 0
-        for y, x in oppMoves:
-            y = adjVal(y)
-            x = adjVal(x)
-            oppMoveAccum += addVal(y)
-            oppMoveAccum += addVal(x)
-
+        if parentIsAI is None:
+            parentIsAI = self.parentIsAI
+        score = self.score if parentIsAI else -self.score
         mobility = len(self.listMoves(parentIsAI)) - len(self.listMoves(not parentIsAI))
 
-        return ((myMoveAccum - oppMoveAccum) / boardLen ** 2) + (mobility * 0.25)
+        return (score / boardLen ** 2) + (mobility * 0.25)
 
-    def listMoves(self, parentIsAI=None): # method implementation varies from game to game
+    def listMoves(self, parentIsAI=None): # method implementation varies from game to game; cached, so callers mustn't change the returned set
+        if parentIsAI is None:
+            parentIsAI = self.parentIsAI
+        ret = self.moveCache.get(parentIsAI)
+        if ret is None:
+            ret = self.genMoves(parentIsAI)
+            self.moveCache[parentIsAI] = ret
+        return ret
+
+    def genMoves(self, parentIsAI):
         myMoves, oppMoves = self.whatsMyMoves(parentIsAI)
 
         def genPatch(y, x):
@@ -159,6 +267,152 @@ class OthState(State):
         else:
             return {-1,}
 
+class BitOthState(State): # OthState on two bitboards, e.g. Othello(state=BitOthState()); board, blackPos and whitePos are computed when asked for
+    def __init__(self, state=None, parentIsAI=False):
+        super().__init__(parentIsAI=parentIsAI)
+        if state is None:
+            self.black = 1 << ((mid - 1) * boardLen + mid) | 1 << (mid * boardLen + mid - 1)
+            self.white = 1 << ((mid - 1) * boardLen + mid - 1) | 1 << (mid * boardLen + mid)
+            self.rehash()
+        else:
+            self.state = state
+
+    @property
+    def state(self): # the int8 board OthState keeps, for printing
+        board = np.zeros(boardLen ** 2, dtype=np.int8)
+        board[list(bitSquares(self.black))] = -1
+        board[list(bitSquares(self.white))] = 1
+        return board.reshape(boardLen, boardLen)
+
+    @state.setter
+    def state(self, board):
+        if board is None:
+            return
+        flat = np.asarray(board).reshape(-1)
+        self.black = sum(1 << int(sq) for sq in np.flatnonzero(flat == -1))
+        self.white = sum(1 << int(sq) for sq in np.flatnonzero(flat == 1))
+        self.rehash()
+
+    @property
+    def blackPos(self):
+        return {(sq // boardLen, sq % boardLen) for sq in bitSquares(self.black)}
+
+    @property
+    def whitePos(self):
+        return {(sq // boardLen, sq % boardLen) for sq in bitSquares(self.white)}
+
+    def rehash(self): # hash and score from scratch, makeMove and undoMove keep them up to date after that
+        self.score = weighBits(self.white) - weighBits(self.black)
+        self.hash = 0
+        for sq in bitSquares(self.black):
+            self.hash ^= pieceKeys[0][sq]
+        for sq in bitSquares(self.white):
+            self.hash ^= pieceKeys[1][sq]
+
+    def update(self, move):
+        self.makeMove(move)
+
+    def makeMove(self, move): # returns the flipped squares as a bitboard
+        if move == -1:
+            self.parentIsAI = not self.parentIsAI
+            return 0
+
+        bit = 1 << move
+        assert not (self.black | self.white) & bit
+        if self.parentIsAI:
+            flipped = flipBits(self.white, self.black, move)
+            self.white |= bit | flipped
+            self.black ^= flipped
+            self.hash ^= pieceKeys[1][move]
+            sign = 1
+        else:
+            flipped = flipBits(self.black, self.white, move)
+            self.black |= bit | flipped
+            self.white ^= flipped
+            self.hash ^= pieceKeys[0][move]
+            sign = -1
+        self.score += sign * squareWeights[move]
+        for sq in bitSquares(flipped):
+            self.hash ^= flipKeys[sq]
+            self.score += 2 * sign * squareWeights[sq]
+
+        self.parentIsAI = not self.parentIsAI
+        return flipped
+
+    def undoMove(self, move, flipped):
+        self.parentIsAI = not self.parentIsAI
+        if move == -1:
+            return
+
+        bit = 1 << move
+        if self.parentIsAI:
+            self.white ^= bit | flipped
+            self.black |= flipped
+            self.hash ^= pieceKeys[1][move]
+            sign = 1
+        else:
+            self.black ^= bit | flipped
+            self.white |= flipped
+            self.hash ^= pieceKeys[0][move]
+            sign = -1
+        self.score -= sign * squareWeights[move]
+        for sq in bitSquares(flipped):
+            self.hash ^= flipKeys[sq]
+            self.score -= 2 * sign * squareWeights[sq]
+
+    def isTerminal(self, depth, maxDepth):
+        numBlacks = self.black.bit_count()
+        numWhites = self.white.bit_count()
+
+        if depth >= maxDepth:
+            return self.evalPieces(True)
+
+        if numBlacks == 0:
+            return 999
+        if numWhites == 0:
+            return -999
+
+        if (self.black | self.white) == full or (moveBits(self.black, self.white) == 0 and moveBits(self.white, self.black) == 0):
+            return 999 * int(np.sign(numWhites - numBlacks))
+        return None
+
+    def copy(self):
+        ret = BitOthState.__new__(BitOthState)
+        ret.parentIsAI = self.parentIsAI
+        ret.black = self.black
+        ret.white = self.white
+        ret.hash = self.hash
+        ret.score = self.score
+        return ret
+
+    def key(self):
+        return self.hash ^ sideKey if self.parentIsAI else self.hash
+
+    def whatsMyMoves(self, parentIsAI=None): # (mine, opponent's) as bitboards
+        if parentIsAI is None:
+            parentIsAI = self.parentIsAI
+        if parentIsAI:
+            return self.white, self.black
+        return self.black, self.white
+
+    def evalPieces(self, parentIsAI=None):
+        if parentIsAI is None:
+            parentIsAI = self.parentIsAI
+        me, opp = self.whatsMyMoves(parentIsAI)
+        score = self.score if parentIsAI else -self.score
+        mobility = max(moveBits(me, opp).bit_count(), 1) - max(moveBits(opp, me).bit_count(), 1) # a pass counts as a move, as in OthState
+        return (score / boardLen ** 2) + (mobility * 0.25)
+
+    def listMoves(self, parentIsAI=None): # generating is cheap enough here not to cache
+        return self.genMoves(parentIsAI)
+
+    def genMoves(self, parentIsAI=None):
+        me, opp = self.whatsMyMoves(parentIsAI)
+        moves = moveBits(me, opp)
+        if moves:
+            return set(bitSquares(moves))
+        return {-1,}
+
 class OthNode(Node):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -172,7 +426,7 @@ class OthNode(Node):
 
 class Othello(Game):
     def __init__(self, state=None):
-        self.state = OthState()
+        self.state = OthState() if state is None else state
         self.turn = True # says that you are going first
 
     def play(self, val, verbose=True): # returns an int reward, and a None if the game hasn't finished yet
@@ -236,5 +490,6 @@ class Othello(Game):
                 print('{} '.format(readableSigns[elem]), end='')
             print()
 
-oth = Othello()
-oth.fightAI(OthNode)
+if __name__ == '__main__':
+    oth = Othello()
+    oth.fightAI(OthNode)
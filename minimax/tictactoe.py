@@ -5,6 +5,7 @@ import numpy as np
 import random
 
 length = 3
+pieceKeys, sideKey = zobristKeys(2, length ** 2) # index 0 for X (-1), 1 for O (1)
 
 class TTTState(State):
     def __init__(self, state=None):
@@ -14,6 +15,9 @@ class TTTState(State):
         else:
             self.state = state
         self.x = True
+        self.hash = 0
+        for move in np.flatnonzero(self.state):
+            self.hash ^= pieceKeys[(self.state.flat[move] + 1) // 2][move]
 
     def update(self, move):
         y, x = move // self.length, move % self.length
@@ -22,11 +26,28 @@ class TTTState(State):
 
         if self.x:
             self.state[y][x] = -1
+            self.hash ^= pieceKeys[0][move]
         else:
             self.state[y][x] = 1
+            self.hash ^= pieceKeys[1][move]
 
         self.x = not self.x
 
+    def makeMove(self, move):
+        self.update(move)
+        return None
+
+    def undoMove(self, move, record):
+        self.x = not self.x
+        self.state.flat[move] = 0
+        self.hash ^= pieceKeys[0 if self.x else 1][move]
+
+    def listMoves(self):
+        return set(np.flatnonzero(self.state == 0))
+
+    def key(self): # the side to move is folded in here, since nodes set x directly
+        return self.hash ^ sideKey if self.x else self.hash
+
     def isTerminal(self, depth, maxDepth):
         for idx, row in enumerate(self.state):
             if np.abs(np.sum(row)) == self.length:
@@ -54,6 +75,7 @@ class TTTState(State):
         myClass = type(self)
         ret = myClass(state=np.array(self.state, copy=True))
         ret.x = self.x
+        ret.hash = self.hash
         return ret
 
 class TTTNode(Node):
@@ -65,9 +87,7 @@ class TTTNode(Node):
         self.state.x = not self.parentIsAI
 
     def listMoves(self): # method implementation varies from game to game
-        ys, xs = np.where(self.state.state == 0) # for [[0, 1], [1, 0]], np.where(arr == 0) returns [0, 1] (y-indices), [0, 1] (corresponding x-indices)
-        ret = set(ys * self.state.state.shape[0] + xs)
-        return ret
+        return self.state.listMoves()
 
 class TTT(Game):
     def __init__(self, state=None):
@@ -127,9 +147,10 @@ class TTT(Game):
                 print('___')
         print('------------------------------------')
 
-#trialsPretrain = int(1e6)
-ttt = TTT()
-#ttt.saveAI(TTTNode, 'ttt.pkl', 'ttt.pkl', trialsPretrain=trialsPretrain)
-#ttt.saveAI(TTTNode, 'ttt.pkl', trialsPretrain=trialsPretrain)
-ttt.fightAI(TTTNode)
-#ttt.fightAI(TTTNode, 'ttt.pkl')
+if __name__ == '__main__':
+    #trialsPretrain = int(1e6)
+    ttt = TTT()
+    #ttt.saveAI(TTTNode, 'ttt.pkl', 'ttt.pkl', trialsPretrain=trialsPretrain)
+    #ttt.saveAI(TTTNode, 'ttt.pkl', trialsPretrain=trialsPretrain)
+    ttt.fightAI(TTTNode)
+    #ttt.fightAI(TTTNode, 'ttt.pkl')